@@ -0,0 +1,132 @@
+# Measure how many DNS queries a second the hotspot's dnsmasq answers, and
+# the TTL it gives them (DNSMASQ_LOCAL_TTL in .env.global).
+#
+# Run it on the device while the portal is up, or on a computer connected to
+# the hotspot:
+#   python3 dns_benchmark.py [-s server] [-p port] [-n queries] [-c concurrency] [-d name]
+
+import asyncio, getopt, itertools, os, struct, sys, time
+
+SERVER = '192.168.42.1'
+PORT = 53
+QUERIES = 10000
+CONCURRENCY = 32 # queries in flight at once
+NAME = 'connectivitycheck.gstatic.com'
+TIMEOUT = 2 # seconds before a query counts as lost
+
+
+#------------------------------------------------------------------------------
+# An A query for name, with the given id.
+def build_query(query_id: int, name: str) -> bytes:
+    header = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) # RD, 1 question
+    qname = b''.join(bytes([len(label)]) + label.encode('ascii')
+            for label in name.split('.')) + b'\0'
+    return header + qname + struct.pack('!HH', 1, 1) # A, IN
+
+
+# Skip a (possibly compressed) name, return the offset after it.
+def skip_name(packet: bytes, offset: int) -> int:
+    while True:
+        length = packet[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+        if length == 0:
+            return offset
+
+
+# Return (id, TTL of the first answer or None) of a response.
+def parse_response(packet: bytes) -> tuple[int, int | None]:
+    query_id, _, qdcount, ancount = struct.unpack('!HHHH', packet[:8])
+    offset = 12
+    for _ in range(qdcount):
+        offset = skip_name(packet, offset) + 4
+    if not ancount:
+        return query_id, None
+    offset = skip_name(packet, offset)
+    _, _, ttl = struct.unpack('!HHI', packet[offset:offset + 8])
+    return query_id, ttl
+
+
+#------------------------------------------------------------------------------
+class Client(asyncio.DatagramProtocol):
+
+    def __init__(self):
+        self.waiting = {} # query id -> future
+        self.ttls = set()
+
+    def datagram_received(self, data, addr):
+        try:
+            query_id, ttl = parse_response(data)
+        except (IndexError, struct.error):
+            return
+        future = self.waiting.pop(query_id, None)
+        if future is not None and not future.done():
+            self.ttls.add(ttl)
+            future.set_result(None)
+
+
+async def benchmark(server, port, queries, concurrency, name):
+    loop = asyncio.get_running_loop()
+    transport, client = await loop.create_datagram_endpoint(Client,
+            remote_addr=(server, port))
+    ids = itertools.cycle(range(0x10000))
+    remaining = queries
+    latencies = []
+    lost = 0
+
+    async def worker():
+        nonlocal remaining, lost
+        while remaining > 0:
+            remaining -= 1
+            query_id = next(ids)
+            future = loop.create_future()
+            client.waiting[query_id] = future
+            start = time.perf_counter()
+            transport.sendto(build_query(query_id, name))
+            try:
+                await asyncio.wait_for(future, TIMEOUT)
+                latencies.append(time.perf_counter() - start)
+            except asyncio.TimeoutError:
+                client.waiting.pop(query_id, None)
+                lost += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    transport.close()
+
+    latencies.sort()
+    print(f'{len(latencies)} of {queries} queries answered in {elapsed:.2f}s, {len(latencies) / elapsed:.0f} queries/s, {lost} lost')
+    if latencies:
+        print(f'latency: median {latencies[len(latencies) // 2] * 1000:.2f}ms, 99th percentile {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms')
+    print(f'answer TTLs: {sorted(ttl for ttl in client.ttls if ttl is not None) or "no answers"}')
+
+
+def usage():
+    print(f'Usage: {os.path.basename(sys.argv[0])} [-s server] [-p port] [-n queries] [-c concurrency] [-d name]')
+
+
+if __name__ == '__main__':
+    server, port, queries, concurrency, name = SERVER, PORT, QUERIES, CONCURRENCY, NAME
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 's:p:n:c:d:h')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-s':
+            server = arg
+        elif opt == '-p':
+            port = int(arg)
+        elif opt == '-n':
+            queries = int(arg)
+        elif opt == '-c':
+            concurrency = int(arg)
+        elif opt == '-d':
+            name = arg
+        elif opt == '-h':
+            usage()
+            sys.exit()
+
+    asyncio.run(benchmark(server, port, queries, concurrency, name))
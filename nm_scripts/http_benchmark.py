@@ -0,0 +1,123 @@
+# Measure how fast the portal answers captive portal probes while many
+# clients are connected to it.
+#
+# Each client keeps one keep-alive connection open and sends a probe, waits,
+# and sends the next, like a phone on the hotspot.  Optionally some more
+# connections make one request and then sit idle, holding their keep-alive
+# connection open as browsers do.
+#
+# Run it on a computer connected to the hotspot, or on the device:
+#   python3 http_benchmark.py [-s server] [-p port] [-c clients] [-n probes] [-i interval] [-k idle] [-u path]
+
+import getopt, http.client, os, sys, threading, time
+
+SERVER = '192.168.42.1'
+PORT = 80
+CLIENTS = 32
+PROBES = 20 # per client
+INTERVAL = 0.1 # seconds between the probes of one client
+IDLE = 0 # connections that make one request and then sit idle
+PATH = '/generate_204'
+HOST = 'connectivitycheck.gstatic.com'
+TIMEOUT = 30 # seconds before a probe counts as failed
+
+
+#------------------------------------------------------------------------------
+# One probe on an open connection, returns its latency in seconds.
+def probe(conn: http.client.HTTPConnection, path: str) -> float:
+    start = time.perf_counter()
+    conn.request('GET', path, headers={'Host': HOST})
+    response = conn.getresponse()
+    response.read()
+    return time.perf_counter() - start
+
+
+def client(server, port, probes, interval, path, latencies, errors, lock):
+    conn = http.client.HTTPConnection(server, port, timeout=TIMEOUT)
+    try:
+        for _ in range(probes):
+            try:
+                try:
+                    latency = probe(conn, path)
+                except (ConnectionError, http.client.RemoteDisconnected):
+                    # The server closed the idle connection, a browser
+                    # reconnects and asks again.
+                    conn.close()
+                    latency = probe(conn, path)
+            except (OSError, http.client.HTTPException) as e:
+                with lock:
+                    errors.append(e)
+                conn.close() # reconnects on the next request
+                continue
+            with lock:
+                latencies.append(latency)
+            time.sleep(interval)
+    finally:
+        conn.close()
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def benchmark(server, port, clients, probes, interval, idle, path):
+    # The idle connections first, so they hold on to whatever they hold.
+    idle_connections = []
+    for _ in range(idle):
+        conn = http.client.HTTPConnection(server, port, timeout=TIMEOUT)
+        probe(conn, path)
+        idle_connections.append(conn)
+
+    latencies, errors, lock = [], [], threading.Lock()
+    threads = [threading.Thread(target=client,
+            args=(server, port, probes, interval, path, latencies, errors, lock))
+            for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for conn in idle_connections:
+        conn.close()
+
+    latencies.sort()
+    print(f'{clients} clients, {idle} idle connections: {len(latencies)} of {clients * probes} probes answered in {elapsed:.2f}s, {len(errors)} failed')
+    if latencies:
+        print(f'latency: p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p99 {percentile(latencies, 0.99) * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms')
+    if errors:
+        print(f'first error: {errors[0]!r}')
+
+
+def usage():
+    print(f'Usage: {os.path.basename(sys.argv[0])} [-s server] [-p port] [-c clients] [-n probes] [-i interval] [-k idle] [-u path]')
+
+
+if __name__ == '__main__':
+    server, port, clients, probes, interval, idle, path = \
+            SERVER, PORT, CLIENTS, PROBES, INTERVAL, IDLE, PATH
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 's:p:c:n:i:k:u:h')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-s':
+            server = arg
+        elif opt == '-p':
+            port = int(arg)
+        elif opt == '-c':
+            clients = int(arg)
+        elif opt == '-n':
+            probes = int(arg)
+        elif opt == '-i':
+            interval = float(arg)
+        elif opt == '-k':
+            idle = int(arg)
+        elif opt == '-u':
+            path = arg
+        elif opt == '-h':
+            usage()
+            sys.exit()
+
+    benchmark(server, port, clients, probes, interval, idle, path)
@@ -0,0 +1,214 @@
+# Access point scanning and scan results.
+#
+# Each AP's properties are fetched with a single
+# org.freedesktop.DBus.Properties.GetAll call, and the calls for all APs are
+# issued concurrently, instead of one Get round trip per property.
+#
+# A scan waits for the device LastScan property to change, rather than
+# reading the (stale) AP list right after RequestScan, and can hand out APs
+# as NM reports them with AccessPointAdded.
+
+import asyncio, time
+import logging
+from dataclasses import dataclass
+
+from sdbus import DbusFailedError
+from nm_async import AccessPoint, NetworkDeviceWireless
+
+from ap_security import classify
+
+SCAN_TIMEOUT = 10 # seconds, a full scan usually lands in 3-5
+
+logger = logging.getLogger('wifi-connect')
+
+
+#------------------------------------------------------------------------------
+# The properties of one AP that we use.
+@dataclass(slots=True)
+class AccessPointRecord:
+    path: str
+    ssid: bytes
+    bssid: str
+    frequency: int # MHz
+    strength: int # percent
+    flags: int
+    wpa_flags: int
+    rsn_flags: int
+
+    @classmethod
+    def from_properties(cls, path: str, properties: dict) -> 'AccessPointRecord':
+        return cls(path,
+                   properties.get('ssid', b''),
+                   properties.get('hw_address', ''),
+                   properties.get('frequency', 0),
+                   properties.get('strength', 0),
+                   properties.get('flags', 0),
+                   properties.get('wpa_flags', 0),
+                   properties.get('rsn_flags', 0))
+
+    @property
+    def security(self) -> str:
+        return classify(self.flags, self.wpa_flags, self.rsn_flags)[0]
+
+
+#------------------------------------------------------------------------------
+# Fetch the records for a list of AP paths, one GetAll per AP, all at once.
+# APs that disappear while we ask are left out.
+async def fetch_access_points(access_point_paths: list[str], bus=None) -> list[AccessPointRecord]:
+
+    async def fetch(path):
+        properties = await AccessPoint(path, bus).properties_get_all_dict(
+                on_unknown_member='ignore')
+        return AccessPointRecord.from_properties(path, properties)
+
+    results = await asyncio.gather(*(fetch(path) for path in access_point_paths),
+            return_exceptions=True)
+    return [r for r in results if isinstance(r, AccessPointRecord)]
+
+
+#------------------------------------------------------------------------------
+# Request a scan on a wifi device and yield AccessPointRecords as they become
+# known: first the APs NM already has, then each AP as it is added, until
+# LastScan advances (the scan is complete) or timeout seconds have passed.
+async def stream_access_points(device_path: str, timeout: float = SCAN_TIMEOUT, bus=None):
+    device = NetworkDeviceWireless(device_path, bus)
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def watch_added():
+        async for access_point_path in device.access_point_added:
+            events.put_nowait(('added', access_point_path))
+
+    async def watch_last_scan():
+        async for interface, changed, invalidated in device.properties_changed:
+            if 'LastScan' in changed:
+                events.put_nowait(('scanned', changed['LastScan'][1]))
+
+    watchers = [asyncio.create_task(watch_added()),
+                asyncio.create_task(watch_last_scan())]
+    start = time.monotonic()
+    try:
+        # Subscribe before reading LastScan and requesting the scan, see
+        # nm_events.wait_for_activation().
+        await asyncio.sleep(0)
+        last_scan = await device.last_scan
+        try:
+            await device.request_scan({})
+            scanning = True
+        except DbusFailedError as e:
+            # NM refuses scans right after a previous one, its list is current.
+            logger.debug(f'request_scan: {e}')
+            scanning = False
+
+        seen = set()
+        for record in await fetch_access_points(await device.access_points, bus):
+            seen.add(record.path)
+            yield record
+
+        deadline = start + timeout
+        while scanning and (remaining := deadline - time.monotonic()) > 0:
+            try:
+                event, value = await asyncio.wait_for(events.get(), remaining)
+            except asyncio.TimeoutError:
+                logger.warning(f'Scan on {device_path} did not finish in {timeout}s')
+                break
+
+            if event == 'added':
+                if value in seen:
+                    continue
+                seen.add(value)
+                for record in await fetch_access_points([value], bus):
+                    yield record
+            elif value != last_scan:
+                # Done, pick up anything we did not get a signal for.
+                remaining_paths = [path for path in await device.access_points
+                        if path not in seen]
+                for record in await fetch_access_points(remaining_paths, bus):
+                    yield record
+                logger.debug(f'Scan on {device_path} took {time.monotonic() - start:.2f}s')
+                break
+    finally:
+        for watcher in watchers:
+            watcher.cancel()
+        await asyncio.gather(*watchers, return_exceptions=True)
+
+
+#------------------------------------------------------------------------------
+# Scan on each of the devices at once and return all the APs once the scans
+# are complete (or timed out).  on_partial, if given, is called with the list
+# of APs found so far each time one comes in, so the caller can show them
+# before the slowest scan is done.
+async def scan_access_points(device_paths: list[str], timeout: float = SCAN_TIMEOUT,
+        bus=None, on_partial=None) -> list[AccessPointRecord]:
+    access_points = []
+
+    async def scan(device_path):
+        async for record in stream_access_points(device_path, timeout, bus):
+            access_points.append(record)
+            if on_partial is not None:
+                on_partial(access_points)
+
+    await asyncio.gather(*(scan(device_path) for device_path in device_paths))
+    return access_points
+
+
+#------------------------------------------------------------------------------
+# The band of a frequency in MHz: '2.4', '5' or '6' (GHz), '' for others.
+def band(frequency: int) -> str:
+    if 2400 <= frequency < 2500:
+        return '2.4'
+    if 4900 <= frequency < 5925:
+        return '5'
+    if 5925 <= frequency <= 7125:
+        return '6'
+    return ''
+
+
+#------------------------------------------------------------------------------
+# All the BSSIDs we see of one network.
+@dataclass(slots=True)
+class Network:
+    ssid: bytes
+    security: str
+    bssid: str # the strongest BSSID
+    strength: int # percent, of the strongest BSSID
+    frequency: int # MHz, of the strongest BSSID
+    bands: set
+    bssid_count: int
+
+    # The entry in the SSID list we send to the portal.
+    def to_dict(self) -> dict:
+        return {'ssid': self.ssid,
+                'security': self.security,
+                'strength': self.strength,
+                'bssid': self.bssid,
+                'frequency': self.frequency,
+                'bands': sorted(self.bands, key=float),
+                'bssids': self.bssid_count}
+
+
+#------------------------------------------------------------------------------
+# Group APs by SSID (and security, issue #8) and return the list of networks
+# for the portal, strongest first.  Blank SSIDs and those in skip_ssids are
+# left out.
+def aggregate_by_ssid(access_points: list[AccessPointRecord],
+        skip_ssids: tuple[bytes, ...] = ()) -> list[dict]:
+    networks = {} # (ssid, security) -> Network
+    for ap in access_points:
+        if ap.ssid == b'' or ap.ssid in skip_ssids:
+            continue
+        key = (ap.ssid, ap.security)
+        network = networks.get(key)
+        if network is None:
+            networks[key] = Network(ap.ssid, ap.security, ap.bssid, ap.strength,
+                    ap.frequency, {band(ap.frequency)} - {''}, 1)
+            continue
+        network.bssid_count += 1
+        if band(ap.frequency):
+            network.bands.add(band(ap.frequency))
+        if ap.strength > network.strength:
+            network.bssid = ap.bssid
+            network.strength = ap.strength
+            network.frequency = ap.frequency
+
+    ranked = sorted(networks.values(), key=lambda n: (-n.strength, n.ssid))
+    return [network.to_dict() for network in ranked]
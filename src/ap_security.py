@@ -0,0 +1,72 @@
+# Classify the security of an access point from its Flags, WpaFlags and
+# RsnFlags properties.
+#
+# All three are bit OR'd combinations of the NM_802_11_AP_SEC_* flags
+# (WpaSecurityFlags) and the NM_802_11_AP_FLAGS_* (AccessPointCapabilities):
+# https://networkmanager.dev/docs/api/latest/nm-dbus-types.html#NM80211ApSecurityFlags
+#
+# A scan only ever holds a handful of different combinations, so the answer
+# for each is remembered rather than worked out again for every AP.  Used by
+# the server and the nm_scripts tools.
+
+from functools import lru_cache
+
+from sdbus_block.networkmanager.enums import (
+    WpaSecurityFlags,
+    AccessPointCapabilities,
+)
+
+# Security types, as sent to the portal.
+SECURITY_NONE       = 'NONE'
+SECURITY_WEP        = 'WEP'
+SECURITY_WPA        = 'WPA'
+SECURITY_WPA2       = 'WPA2' # also WPA2/WPA3 transition networks
+SECURITY_WPA3       = 'WPA3' # SAE only
+SECURITY_OWE        = 'OWE' # Enhanced Open, encrypted but no password
+SECURITY_ENTERPRISE = 'ENTERPRISE'
+
+# What the user has to type into the portal form to connect.
+INPUT_NONE              = 'NONE'
+INPUT_PASSWORD          = 'PASSWORD'
+INPUT_USERNAME_PASSWORD = 'USERNAME PASSWORD'
+
+REQUIRED_INPUT = {
+    SECURITY_NONE:       INPUT_NONE,
+    SECURITY_WEP:        INPUT_PASSWORD,
+    SECURITY_WPA:        INPUT_PASSWORD,
+    SECURITY_WPA2:       INPUT_PASSWORD,
+    SECURITY_WPA3:       INPUT_PASSWORD,
+    SECURITY_OWE:        INPUT_NONE,
+    SECURITY_ENTERPRISE: INPUT_USERNAME_PASSWORD,
+}
+
+ENTERPRISE_KEY_MGMT = WpaSecurityFlags.AUTH_802_1X | WpaSecurityFlags.AUTH_EAP_SUITE_B
+
+
+#------------------------------------------------------------------------------
+# Return (security, required input) for an AP, e.g. ('WPA2', 'PASSWORD').
+@lru_cache(maxsize=256)
+def classify(flags: int, wpa_flags: int, rsn_flags: int) -> tuple[str, str]:
+    security = security_type(flags, wpa_flags, rsn_flags)
+    return security, REQUIRED_INPUT[security]
+
+
+def security_type(flags: int, wpa_flags: int, rsn_flags: int) -> str:
+    # The open half of an OWE transition pair only points at its encrypted
+    # twin, it is itself open.
+    rsn_flags &= ~WpaSecurityFlags.AUTH_OWE_TM
+
+    if (wpa_flags | rsn_flags) & ENTERPRISE_KEY_MGMT:
+        return SECURITY_ENTERPRISE
+    if rsn_flags & WpaSecurityFlags.AUTH_SAE and \
+            not rsn_flags & WpaSecurityFlags.AUTH_PSK:
+        return SECURITY_WPA3
+    if rsn_flags & WpaSecurityFlags.AUTH_OWE:
+        return SECURITY_OWE
+    if rsn_flags != WpaSecurityFlags.NONE:
+        return SECURITY_WPA2
+    if wpa_flags != WpaSecurityFlags.NONE:
+        return SECURITY_WPA
+    if flags & AccessPointCapabilities.PRIVACY:
+        return SECURITY_WEP
+    return SECURITY_NONE
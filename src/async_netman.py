@@ -0,0 +1,306 @@
+# asyncio version of netman, built on sdbus_async.networkmanager.
+#
+# Same functions and return values as netman, but every D-Bus call is awaited
+# and independent property reads are gathered, so scanning or connecting does
+# not stall an event loop that is also serving HTTP requests.
+#
+# All proxies use the bus returned by get_bus().  It is opened on first use
+# and belongs to the event loop that first awaits on it; call set_bus() before
+# that to use another bus (for example a private dbus-daemon).
+
+import asyncio
+import logging
+
+import sdbus
+from sdbus import DbusFailedError
+from nm_async import (
+    ActiveConnection,
+    NetworkManager,
+    NetworkConnectionSettings,
+)
+from sdbus_async.networkmanager.enums import ConnectionType, DeviceType
+
+from connection_profiles import (
+    HOTSPOT_CONNECTION_NAME,
+    GENERIC_CONNECTION_NAME,
+    CONN_TYPE_HOTSPOT,
+)
+from netman_common import (
+    ACTIVATION_TIMEOUT,
+    DEACTIVATION_TIMEOUT,
+    SCAN_TIMEOUT,
+    HOTSPOT_IN_MEMORY,
+    REUSE_HOTSPOT_PROFILE,
+    UPDATE2_FLAG_TO_DISK,
+    UPDATE2_FLAG_IN_MEMORY,
+    get_hotspot_SSID,
+    get_hotspot_device,
+    get_station_device,
+    is_dual_radio,
+    get_hotspot_interface,
+    connection_persistence,
+    prepare_connection,
+    mark_connected,
+)
+from nm_events import wait_for_activation, wait_for_deactivation
+from connection_index import ConnectionIndex, ConnectionRecords, get_index
+from device_registry import DeviceRecord, DeviceRegistry, get_registry
+from access_points import scan_access_points, aggregate_by_ssid
+
+logger = logging.getLogger('wifi-connect')
+
+_bus = None
+
+
+#------------------------------------------------------------------------------
+# The bus all proxies in this module are created on.
+def get_bus():
+    global _bus
+    if _bus is None:
+        _bus = sdbus.sd_bus_open_system()
+    return _bus
+
+
+def set_bus(bus) -> None:
+    global _bus
+    _bus = bus
+
+
+#------------------------------------------------------------------------------
+# The device_registry and connection_index.  The first call loads them from NM
+# with blocking calls, so it runs in a worker thread; after that they are kept
+# up to date from signals and this returns at once.
+async def registry() -> DeviceRegistry:
+    return await asyncio.to_thread(get_registry)
+
+
+async def index() -> ConnectionIndex:
+    return await asyncio.to_thread(get_index)
+
+
+#------------------------------------------------------------------------------
+# Return the managed wifi devices that have an ip4 config, from the
+# device_registry.
+async def get_wifi_devices() -> list[DeviceRecord]:
+    return (await registry()).wifi_devices(configured_only=True)
+
+
+#------------------------------------------------------------------------------
+# Same as utility.get_connections(), from the connection_index.
+async def get_connections(ifname: str, dev_type: str) -> ConnectionRecords:
+    return (await index()).find(getattr(ConnectionType, dev_type), ifname)
+
+
+async def delete_connection_by_uuid(connection_uuid: str) -> None:
+    await (await index()).delete_many_async([connection_uuid])
+
+
+#------------------------------------------------------------------------------
+# Remove ALL wifi connections - to start clean or before running the hotspot.
+# With interface, only the connections of that device.
+async def delete_all_wifi_connections(interface: str | None = None) -> None:
+    uuids = set()
+    wifi_devices = [d for d in await get_wifi_devices()
+            if interface is None or d.interface == interface]
+    for device in wifi_devices:
+        for record in await get_connections(device.interface, DeviceType.WIFI.name):
+            # The hotspot profile is ours to keep when we reuse it.
+            if REUSE_HOTSPOT_PROFILE and record.id == HOTSPOT_CONNECTION_NAME:
+                continue
+            uuids.add(record.uuid)
+
+    await delete_connections(uuids, wifi_devices)
+
+
+#------------------------------------------------------------------------------
+# Stop and delete the hotspot, or with REUSE_HOTSPOT_PROFILE just stop it.
+async def stop_hotspot() -> bool:
+    if REUSE_HOTSPOT_PROFILE:
+        return await deactivate_connection(HOTSPOT_CONNECTION_NAME)
+    return await stop_connection(HOTSPOT_CONNECTION_NAME)
+
+
+#------------------------------------------------------------------------------
+# Deactivate a connection, keeping its profile.  Returns once the devices
+# have let go of it, True if it was active.
+async def deactivate_connection(conn_name: str) -> bool:
+    nm = NetworkManager(get_bus())
+
+    async def deactivate(device):
+        if device.active_connection == '/':
+            return False
+        try:
+            if await ActiveConnection(device.active_connection, get_bus()).id != conn_name:
+                return False
+            await nm.deactivate_connection(device.active_connection)
+            return True
+        except DbusFailedError:
+            return False # deactivated while we looked
+
+    devices = (await registry()).devices()
+    deactivated = await asyncio.gather(*(deactivate(device) for device in devices))
+    busy_devices = [d.path for d, busy in zip(devices, deactivated) if busy]
+    await wait_for_deactivation(busy_devices, DEACTIVATION_TIMEOUT, get_bus())
+    return len(busy_devices) > 0
+
+
+#------------------------------------------------------------------------------
+# Generic connection stopper / deleter.
+async def stop_connection(conn_name: str = GENERIC_CONNECTION_NAME) -> bool:
+    uuids = set()
+    wifi_devices = await get_wifi_devices()
+    for device in wifi_devices:
+        connections = await get_connections(device.interface, DeviceType.WIFI.name)
+        uuids.update(connections.with_id(conn_name).uuids())
+
+    await delete_connections(uuids, wifi_devices)
+    return len(uuids) > 0
+
+
+#------------------------------------------------------------------------------
+# asyncio version of netman.delete_connections(), returns once NM has removed
+# the profiles and the devices that were using them have let go.
+async def delete_connections(uuids: set[str], devices: list[DeviceRecord]) -> None:
+    if not uuids:
+        return
+
+    async def is_using(device):
+        if device.active_connection == '/':
+            return False
+        try:
+            return await ActiveConnection(device.active_connection, get_bus()).uuid in uuids
+        except DbusFailedError:
+            return False # deactivated while we looked
+
+    using = await asyncio.gather(*(is_using(device) for device in devices))
+    busy_devices = [d.path for d, used in zip(devices, using) if used]
+
+    await (await index()).delete_many_async(uuids)
+    await wait_for_deactivation(busy_devices, DEACTIVATION_TIMEOUT, get_bus())
+
+
+#------------------------------------------------------------------------------
+# Return a list of available SSIDs, their security type and signal, strongest
+# first, or [] for none available or error.
+# on_partial, if given, is called with the same list for the networks found
+# so far while the scan is running.
+async def get_list_of_access_points(on_partial=None):
+
+    devices = await get_wifi_devices()
+    if is_dual_radio():
+        # The hotspot radio is busy being an AP, scan on the other one.
+        devices = [get_station_device()]
+    hotspot_ssid = get_hotspot_SSID().encode('utf-8')
+
+    def publish(access_points):
+        on_partial(aggregate_by_ssid(access_points, (hotspot_ssid,)))
+
+    # update the available ssids for all devices
+    access_points = await scan_access_points(
+            [device.path for device in devices], SCAN_TIMEOUT, get_bus(),
+            on_partial=publish if on_partial else None)
+    for ap in access_points:
+        logger.debug(f'{ap.ssid.decode(errors="replace"):15} {ap.bssid} {ap.frequency}MHz {ap.strength}% Flags=0x{ap.flags:X} WpaFlags=0x{ap.wpa_flags:X} RsnFlags=0x{ap.rsn_flags:X}')
+
+    # One entry per network, issue #8, without our own hotspot.
+    ssids = aggregate_by_ssid(access_points, (hotspot_ssid,))
+
+    logger.debug(f'Available SSIDs: {ssids}')
+    return ssids
+
+
+#------------------------------------------------------------------------------
+# Start a local hotspot on the wifi interface.
+# Returns True for success, False for error.
+async def start_hotspot() -> bool:
+    return await connect_to_AP(CONN_TYPE_HOTSPOT, HOTSPOT_CONNECTION_NAME,
+            get_hotspot_SSID())
+
+
+#------------------------------------------------------------------------------
+# Generic connect to the user selected AP function.
+# Returns True for success, or False.
+async def connect_to_AP(conn_type=None, conn_name=GENERIC_CONNECTION_NAME,
+        ssid=None, username=None, password=None, on_state=None) -> bool:
+
+    logger.debug(f"connect_to_AP conn_type={conn_type} conn_name={conn_name} ssid={ssid} username={username}")
+
+    if conn_type is None or ssid is None:
+        logger.error(f'connect_to_AP() Error: Missing args conn_type or ssid')
+        return False
+
+    try:
+        # Load the registry and index off the event loop before the
+        # helpers below read them.
+        await registry()
+        await index()
+
+        prepared = prepare_connection(conn_type, conn_name, ssid, username,
+                password)
+        if prepared is None:
+            return False
+        device, conn_dict, conn_str = prepared
+        device_path = device.path
+
+        nm = NetworkManager(get_bus())
+
+        # If a connection with this name exists, start clean, unless it is
+        # the hotspot profile we reuse.
+        existing = get_index().get_by_id(conn_name)
+        if existing and conn_type == CONN_TYPE_HOTSPOT and REUSE_HOTSPOT_PROFILE:
+            await get_index().delete_many_async(existing.uuids()[1:])
+            existing = next(iter(existing))
+        elif existing:
+            # With two radios, leave the other one (and the hotspot) alone.
+            await delete_all_wifi_connections(
+                    device.interface if is_dual_radio() else None)
+            existing = None
+
+        persist = None
+        if existing:
+            # Change the SSID, band, channel and address of the profile we
+            # have (keeping its uuid) and activate it again.
+            conn_dict['connection']['uuid'] = ('s', existing.uuid)
+            flags = UPDATE2_FLAG_IN_MEMORY if HOTSPOT_IN_MEMORY \
+                    else UPDATE2_FLAG_TO_DISK
+            await NetworkConnectionSettings(existing.path, get_bus()).update2(
+                    conn_dict, flags, {})
+            active_path = await nm.activate_connection(existing.path,
+                    device_path, "/")
+            logger.info(f"Updated connection {conn_name} and activated it.")
+        else:
+            # Add the profile and activate it on the device in one call, NM
+            # replaces whatever connection the device has.
+            persist = connection_persistence(conn_type)
+            conn_path, active_path, _ = await nm.add_and_activate_connection2(
+                    conn_dict, device_path, "/", {'persist': ('s', persist)})
+            logger.info(f"Added connection {conn_name} of type {conn_str} ({persist}) and activated it.")
+
+        logger.info(f'Waiting for connection to become active...')
+        result = await wait_for_activation(device_path, active_path,
+                timeout=ACTIVATION_TIMEOUT, on_state=on_state, bus=get_bus())
+
+        if result.activated:
+            logger.info(f'Connection {conn_name} is live ({result.describe()}).')
+
+            if persist == 'volatile':
+                # The trial worked, keep the profile (empty settings keep the
+                # current ones).
+                await NetworkConnectionSettings(conn_path, get_bus()).update2(
+                        {}, UPDATE2_FLAG_TO_DISK, {})
+                logger.info(f'Saved connection {conn_name} to disk.')
+
+            mark_connected(conn_str)
+            return True
+
+        logger.error(f'Connection {conn_name} did not activate: {result.describe()}')
+
+    except Exception as e:
+        logger.error(f'Connection error {e}')
+
+    logger.error(f'Connection {conn_name} failed.')
+    return False
+
+
+if __name__ == "__main__":
+    asyncio.run(start_hotspot())
@@ -0,0 +1,87 @@
+# The connectivity check URLs operating systems and browsers fetch to find
+# out if they are behind a captive portal.
+#
+# DNS on the hotspot resolves every name to us, so these requests arrive at
+# our HTTP server.  Each one is answered with a redirect to the portal page,
+# which is what makes the client pop up its captive portal browser.  Lookups
+# are a dict access on Host and path, and count the hits per (host, path).
+
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+
+# (host, path): probe name
+PROBES = {
+    # Apple
+    ('captive.apple.com', '/hotspot-detect.html'): 'apple',
+    ('captive.apple.com', '/'): 'apple',
+    ('www.apple.com', '/library/test/success.html'): 'apple',
+    ('www.appleiphonecell.com', '/'): 'apple',
+    # Android and ChromeOS
+    ('connectivitycheck.gstatic.com', '/generate_204'): 'android',
+    ('connectivitycheck.android.com', '/generate_204'): 'android',
+    ('clients3.google.com', '/generate_204'): 'android',
+    ('clients1.google.com', '/generate_204'): 'android',
+    ('play.googleapis.com', '/generate_204'): 'android',
+    ('www.google.com', '/gen_204'): 'android',
+    ('www.gstatic.com', '/generate_204'): 'android',
+    # Windows
+    ('www.msftconnecttest.com', '/connecttest.txt'): 'windows',
+    ('www.msftconnecttest.com', '/redirect'): 'windows',
+    ('www.msftncsi.com', '/ncsi.txt'): 'windows',
+    ('ipv6.msftconnecttest.com', '/connecttest.txt'): 'windows',
+    # Firefox
+    ('detectportal.firefox.com', '/success.txt'): 'firefox',
+    ('detectportal.firefox.com', '/canonical.html'): 'firefox',
+    # Linux desktops (NetworkManager connectivity checks)
+    ('connectivity-check.ubuntu.com', '/'): 'ubuntu',
+    ('nmcheck.gnome.org', '/check_network_status.txt'): 'gnome',
+    ('network-test.debian.org', '/nm'): 'debian',
+    ('fedoraproject.org', '/static/hotspot.txt'): 'fedora',
+    # Kindle
+    ('spectrum.s3.amazonaws.com', '/kindle-wifi/wifistub.html'): 'kindle',
+}
+
+# Paths that are only ever probes, matched whatever the Host header says
+# (clients that use an IP address, or a check host we do not know yet).
+# Paths like /redirect or /nm could well be a page of some site the user
+# asks for, so those only match on their own host.
+PROBE_PATHS = {
+    '/generate_204': 'android',
+    '/hotspot-detect.html': 'apple',
+    '/ncsi.txt': 'windows',
+    '/connecttest.txt': 'windows',
+    '/success.txt': 'firefox',
+}
+ANY_HOST = '*' # the host a PROBE_PATHS match is counted under
+
+
+#------------------------------------------------------------------------------
+# Matches requests against the tables and counts the hits.
+class CaptiveProbes:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = Counter()
+
+    # Return the probe name for a request, or None if it is not a probe.
+    def match(self, host: str | None, path: str) -> str | None:
+        path = urlsplit(path).path
+        host = (host or '').partition(':')[0].lower()
+        name = PROBES.get((host, path))
+        if name is None:
+            name = PROBE_PATHS.get(path)
+            host = ANY_HOST # bounded, whatever Host clients send
+        if name is not None:
+            with self._lock:
+                self._hits[name, host, path] += 1
+        return name
+
+    # Return {probe name: {host + path: hits}}, e.g.
+    # {'android': {'connectivitycheck.gstatic.com/generate_204': 3}}.
+    def hits(self) -> dict[str, dict[str, int]]:
+        result = {}
+        with self._lock:
+            for (name, host, path), count in self._hits.items():
+                result.setdefault(name, {})[host + path] = count
+        return result
@@ -0,0 +1,391 @@
+# A small DNS and DHCP server for the hotspot, that can stand in for dnsmasq
+# (BUILTIN_RESPONDER in .env.global).
+#
+# DNS: every A query is answered with the gateway address, so whatever a
+# client looks up leads to the portal; AAAA, HTTPS and all other queries get
+# an empty answer, so clients do not wait for an address we will never give.
+# DHCP: addresses from the hotspot range are leased, in memory only, with the
+# gateway as router and DNS server, and the portal URL (RFC 8910).
+#
+# Like the connection_index, it runs its own loop in a background thread.
+# Starting it takes no more than binding two sockets.
+
+import asyncio, ipaddress, socket, struct, threading, time
+import logging
+
+logger = logging.getLogger('wifi-connect')
+
+DNS_PORT = 53
+DHCP_SERVER_PORT = 67
+DHCP_CLIENT_PORT = 68
+START_TIMEOUT = 5 # seconds to wait for the sockets to be bound
+
+# DNS
+TYPE_A = 1
+CLASS_IN = 1
+OPCODE_QUERY = 0
+RCODE_NOTIMP = 4
+
+# DHCP
+BOOTREQUEST = 1
+BOOTREPLY = 2
+MAGIC_COOKIE = b'\x63\x82\x53\x63'
+DHCPDISCOVER, DHCPOFFER, DHCPREQUEST, DHCPDECLINE, DHCPACK, DHCPNAK, \
+        DHCPRELEASE, DHCPINFORM = range(1, 9)
+OPT_SUBNET_MASK = 1
+OPT_ROUTER = 3
+OPT_DNS = 6
+OPT_REQUESTED_IP = 50
+OPT_LEASE_TIME = 51
+OPT_MESSAGE_TYPE = 53
+OPT_SERVER_ID = 54
+OPT_CAPTIVE_PORTAL = 114
+OPT_PAD = 0
+OPT_END = 255
+DECLINED_TIME = 600 # seconds an address a client declined is not offered
+
+
+#------------------------------------------------------------------------------
+# dnsmasq style lease time ('45m', '1h', '3600') in seconds.
+def parse_lease_time(value) -> int:
+    value = str(value).strip().lower()
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    if value and value[-1] in units:
+        return int(value[:-1]) * units[value[-1]]
+    return int(value)
+
+
+#------------------------------------------------------------------------------
+# Return the response to a DNS query packet, or None to drop it.
+def dns_response(query: bytes, address: bytes, ttl: int) -> bytes | None:
+    if len(query) < 12:
+        return None
+    query_id, flags, qdcount = struct.unpack('!HHH', query[:6])
+    if flags & 0x8000 or qdcount != 1:
+        return None # a response, or not a question we understand
+
+    # QR, AA, RA and the client's RD
+    reply_flags = 0x8000 | 0x0400 | 0x0080 | (flags & 0x0100)
+    if (flags >> 11) & 0xF != OPCODE_QUERY:
+        return struct.pack('!HHHHHH', query_id, reply_flags | RCODE_NOTIMP,
+                0, 0, 0, 0)
+
+    # The question: the name, as labels, then its type and class.
+    offset = 12
+    try:
+        while query[offset]:
+            if query[offset] & 0xC0:
+                return None # no compression in a question
+            offset += 1 + query[offset]
+        qtype, qclass = struct.unpack('!HH', query[offset + 1:offset + 5])
+    except (IndexError, struct.error):
+        return None
+    question = query[12:offset + 5]
+
+    if qtype == TYPE_A and qclass == CLASS_IN:
+        answer = b'\xc0\x0c' + struct.pack('!HHIH', TYPE_A, CLASS_IN, ttl, 4) + address
+        return struct.pack('!HHHHHH', query_id, reply_flags, 1, 1, 0, 0) \
+                + question + answer
+    # No data, for AAAA, HTTPS and anything else.
+    return struct.pack('!HHHHHH', query_id, reply_flags, 1, 0, 0, 0) + question
+
+
+#------------------------------------------------------------------------------
+# One DHCP packet: the fields we use and the options.
+class DhcpPacket:
+
+    def __init__(self, data: bytes):
+        if len(data) < 240 or data[236:240] != MAGIC_COOKIE:
+            raise ValueError('not a DHCP packet')
+        self.op, self.htype, self.hlen = data[0], data[1], data[2]
+        self.xid = data[4:8]
+        self.flags = data[10:12]
+        self.ciaddr = data[12:16]
+        self.giaddr = data[24:28]
+        self.chaddr = data[28:44]
+        self.mac = data[28:28 + min(self.hlen, 16)].hex(':')
+        self.options = {}
+        offset = 240
+        while offset < len(data) and data[offset] != OPT_END:
+            code = data[offset]
+            if code == OPT_PAD:
+                offset += 1
+                continue
+            length = data[offset + 1]
+            self.options[code] = data[offset + 2:offset + 2 + length]
+            offset += 2 + length
+
+    @property
+    def message_type(self) -> int | None:
+        value = self.options.get(OPT_MESSAGE_TYPE)
+        return value[0] if value else None
+
+    @property
+    def requested_ip(self) -> str | None:
+        value = self.options.get(OPT_REQUESTED_IP)
+        if value and len(value) == 4:
+            return socket.inet_ntoa(value)
+        if self.ciaddr != bytes(4):
+            return socket.inet_ntoa(self.ciaddr)
+        return None
+
+    # Our reply, with yiaddr and the options (code -> bytes) in order.
+    def reply(self, yiaddr: str | None, server: bytes, options: dict) -> bytes:
+        header = bytes([BOOTREPLY, self.htype, self.hlen, 0]) + self.xid \
+                + bytes(2) + self.flags + self.ciaddr \
+                + (socket.inet_aton(yiaddr) if yiaddr else bytes(4)) \
+                + server + self.giaddr + self.chaddr + bytes(192)
+        body = b''.join(bytes([code, len(value)]) + value
+                for code, value in options.items())
+        return header + MAGIC_COOKIE + body + bytes([OPT_END])
+
+
+#------------------------------------------------------------------------------
+# The addresses of the range and who has them.
+class LeasePool:
+
+    def __init__(self, first: str, last: str, lease_time: int, max_leases: int):
+        start = int(ipaddress.IPv4Address(first))
+        end = int(ipaddress.IPv4Address(last))
+        self.addresses = [str(ipaddress.IPv4Address(a)) for a in range(start, end + 1)]
+        self.lease_time = lease_time
+        self.max_leases = max_leases
+        self.leases = {} # mac -> (address, expiry as time.monotonic())
+        self.declined = {} # address -> time.monotonic() it may be offered again
+
+    def _in_use(self) -> dict:
+        now = time.monotonic()
+        self.leases = {mac: lease for mac, lease in self.leases.items()
+                if lease[1] > now}
+        self.declined = {a: t for a, t in self.declined.items() if t > now}
+        return {address: mac for mac, (address, _) in self.leases.items()}
+
+    # The address to offer mac, preferably the one it asks for, or None if
+    # the pool is full.
+    def offer(self, mac: str, requested: str | None) -> str | None:
+        in_use = self._in_use()
+        if mac in self.leases:
+            return self.leases[mac][0]
+        if len(self.leases) >= self.max_leases:
+            return None
+        if requested in self.addresses and requested not in in_use \
+                and requested not in self.declined:
+            return requested
+        for address in self.addresses:
+            if address not in in_use and address not in self.declined:
+                return address
+        return None
+
+    # Lease address to mac, returns False if it is not ours to give.
+    def lease(self, mac: str, address: str) -> bool:
+        in_use = self._in_use()
+        if address not in self.addresses or in_use.get(address, mac) != mac \
+                or address in self.declined:
+            return False
+        if mac not in self.leases and len(self.leases) >= self.max_leases:
+            return False
+        self.leases[mac] = (address, time.monotonic() + self.lease_time)
+        return True
+
+    def release(self, mac: str) -> None:
+        self.leases.pop(mac, None)
+
+    def decline(self, mac: str, address: str) -> None:
+        self.release(mac)
+        self.declined[address] = time.monotonic() + DECLINED_TIME
+
+
+#------------------------------------------------------------------------------
+class DnsProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, responder):
+        self.responder = responder
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        response = dns_response(data, self.responder.gateway_bytes,
+                self.responder.ttl)
+        if response is not None:
+            self.responder.queries += 1
+            self.transport.sendto(response, addr)
+
+
+class DhcpProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, responder):
+        self.responder = responder
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            packet = DhcpPacket(data)
+        except (ValueError, IndexError):
+            return
+        if packet.op != BOOTREQUEST:
+            return
+        reply = self.responder.dhcp_reply(packet)
+        if reply is not None:
+            # The client has no address yet, so always broadcast.
+            self.transport.sendto(reply,
+                    ('255.255.255.255', self.responder.dhcp_client_port))
+
+
+#------------------------------------------------------------------------------
+class CaptiveResponder:
+
+    def __init__(self, gateway: str, dhcp_range: str, ttl: int = 10,
+            lease_time=3600, max_leases: int = 253, portal_url: str | None = None,
+            dns_port: int = DNS_PORT, dhcp_port: int = DHCP_SERVER_PORT,
+            dhcp_client_port: int = DHCP_CLIENT_PORT):
+        self.gateway = gateway
+        self.gateway_bytes = socket.inet_aton(gateway)
+        first, last = dhcp_range.split(',')[:2]
+        self.dhcp_range = (first, last)
+        self.ttl = ttl
+        self.lease_time = parse_lease_time(lease_time)
+        self.max_leases = max_leases
+        self.portal_url = portal_url or f'http://{gateway}/'
+        self.dns_port = dns_port
+        self.dhcp_port = dhcp_port
+        self.dhcp_client_port = dhcp_client_port
+        self.interface = None
+        self.pool = None
+        self.queries = 0 # DNS queries answered
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+        self._started = 0.0
+
+    #--------------------------------------------------------------------------
+    # Answer DNS on the gateway address and DHCP on interface.  Returns True
+    # once the sockets are bound.
+    def start(self, interface: str | None = None) -> bool:
+        self.stop()
+        self.interface = interface
+        self.pool = LeasePool(*self.dhcp_range, self.lease_time, self.max_leases)
+        self.queries = 0
+        self._error = None
+        self._ready.clear()
+        start = time.monotonic()
+        self._thread = threading.Thread(target=self._run,
+                name='captive-responder', daemon=True)
+        self._thread.start()
+        if not self._ready.wait(START_TIMEOUT) or self._error is not None:
+            logger.error(f'Built-in DNS/DHCP responder did not start: {self._error}')
+            return False
+        self._started = time.monotonic()
+        logger.info(f'Started built-in DNS/DHCP responder on {interface}, listening after {self._started - start:.3f}s')
+        return True
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self._thread = None
+        logger.info('Stopped built-in DNS/DHCP responder')
+
+    # What the HTTP server reports.
+    def to_dict(self) -> dict:
+        running = self._thread is not None and self._error is None
+        return {'state': 'running' if running else 'stopped',
+                'interface': self.interface,
+                'responder': 'builtin',
+                'uptime': round(time.monotonic() - self._started, 1) if running else 0,
+                'leases': len(self.pool.leases) if self.pool else 0,
+                'queries': self.queries}
+
+    #--------------------------------------------------------------------------
+    # The reply to a DHCP request, or None for no reply.
+    def dhcp_reply(self, packet: DhcpPacket) -> bytes | None:
+        pool, message_type = self.pool, packet.message_type
+        options = {OPT_MESSAGE_TYPE: None,
+                   OPT_SERVER_ID: self.gateway_bytes,
+                   OPT_LEASE_TIME: struct.pack('!I', self.lease_time),
+                   OPT_SUBNET_MASK: socket.inet_aton('255.255.255.0'),
+                   OPT_ROUTER: self.gateway_bytes,
+                   OPT_DNS: self.gateway_bytes,
+                   OPT_CAPTIVE_PORTAL: self.portal_url.encode('ascii')}
+
+        def reply(reply_type, yiaddr):
+            options[OPT_MESSAGE_TYPE] = bytes([reply_type])
+            return packet.reply(yiaddr, self.gateway_bytes, options)
+
+        if message_type == DHCPDISCOVER:
+            address = pool.offer(packet.mac, packet.requested_ip)
+            if address is None:
+                logger.warning(f'DHCP: no address left for {packet.mac}')
+                return None
+            return reply(DHCPOFFER, address)
+
+        if message_type == DHCPREQUEST:
+            server = packet.options.get(OPT_SERVER_ID)
+            if server is not None and server != self.gateway_bytes:
+                pool.release(packet.mac) # it chose another server
+                return None
+            address = packet.requested_ip
+            if address is None or not pool.lease(packet.mac, address):
+                logger.debug(f'DHCP: NAK {address} for {packet.mac}')
+                del options[OPT_LEASE_TIME]
+                return reply(DHCPNAK, None)
+            logger.debug(f'DHCP: leased {address} to {packet.mac}')
+            return reply(DHCPACK, address)
+
+        if message_type == DHCPRELEASE:
+            pool.release(packet.mac)
+        elif message_type == DHCPDECLINE and packet.requested_ip:
+            pool.decline(packet.mac, packet.requested_ip)
+        elif message_type == DHCPINFORM:
+            del options[OPT_LEASE_TIME]
+            return reply(DHCPACK, None)
+        return None
+
+    #--------------------------------------------------------------------------
+    def _sockets(self) -> tuple[socket.socket, socket.socket]:
+        dns = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        dhcp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            dns.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            dns.bind((self.gateway, self.dns_port))
+
+            dhcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            dhcp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            if self.interface:
+                # Requests are broadcasts, only take (and answer) those from
+                # the hotspot.
+                dhcp.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE,
+                        self.interface.encode())
+            dhcp.bind(('0.0.0.0', self.dhcp_port))
+        except OSError:
+            dns.close()
+            dhcp.close()
+            raise
+        return dns, dhcp
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        transports = []
+        try:
+            dns, dhcp = self._sockets()
+            for protocol, sock in ((DnsProtocol, dns), (DhcpProtocol, dhcp)):
+                transport, _ = self.loop.run_until_complete(
+                        self.loop.create_datagram_endpoint(
+                            lambda: protocol(self), sock=sock))
+                transports.append(transport)
+            self._ready.set()
+            self.loop.run_forever()
+        except OSError as e:
+            self._error = e
+        finally:
+            for transport in transports:
+                transport.close()
+            self.loop.run_until_complete(asyncio.sleep(0)) # let them close
+            self.loop.close()
+            self.loop = None
+            self._ready.set() # do not leave start() waiting
@@ -0,0 +1,140 @@
+# Connection attempts run as background jobs.
+#
+# POST /connect only queues a job and returns its id.  One worker thread runs
+# the jobs in order (stop the hotspot, connect, restart the hotspot on
+# failure, or with two radios just connect) and records their progress,
+# including the NM device states seen while connecting, for
+# GET /connect/status/<id>.
+
+import queue, secrets, threading, time
+import logging
+from collections import OrderedDict
+
+import netman
+
+logger = logging.getLogger('wifi-connect')
+
+MAX_JOBS = 20 # finished jobs we remember
+
+# Job steps, in the order they happen.
+STEP_QUEUED             = 'queued'
+STEP_STOPPING_HOTSPOT   = 'stopping-hotspot'
+STEP_CONNECTING         = 'connecting'
+STEP_RESTARTING_HOTSPOT = 'restarting-hotspot'
+STEP_CONNECTED          = 'connected'
+STEP_FAILED             = 'failed'
+
+
+#------------------------------------------------------------------------------
+# One connection attempt.
+class ConnectJob:
+
+    def __init__(self, ssid: str):
+        self.id = secrets.token_hex(8)
+        self.ssid = ssid
+        self._lock = threading.Lock()
+        self._step = STEP_QUEUED
+        self._device_state = None
+        self._reason = None
+        self._done = False
+        self._created = self._updated = time.time()
+
+    @property
+    def done(self) -> bool:
+        with self._lock:
+            return self._done
+
+    def set_step(self, step: str) -> None:
+        with self._lock:
+            self._step = step
+            self._updated = time.time()
+        logger.debug(f'connect job {self.id}: {step}')
+
+    # Passed to netman.connect_to_AP() as on_state.
+    def device_state_changed(self, state, reason) -> None:
+        with self._lock:
+            self._device_state = getattr(state, 'name', str(state))
+            self._reason = getattr(reason, 'name', str(reason))
+            self._updated = time.time()
+
+    def finish(self, success: bool) -> None:
+        with self._lock:
+            self._step = STEP_CONNECTED if success else STEP_FAILED
+            self._done = True
+            self._updated = time.time()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {'id': self.id,
+                    'ssid': self.ssid,
+                    'step': self._step,
+                    'device_state': self._device_state,
+                    'reason': self._reason,
+                    'done': self._done,
+                    'created': self._created,
+                    'updated': self._updated}
+
+
+#------------------------------------------------------------------------------
+# The jobs and the thread that runs them.
+# run(job, **params) does the work of one job and returns True on success.
+class ConnectJobs:
+
+    def __init__(self, run):
+        self._run = run
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._current = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name='connect-jobs',
+                daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    # Stop the worker, after the job it is running (if any).
+    def stop(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    #--------------------------------------------------------------------------
+    # Create a job for ssid, unless one is already queued or running.
+    # Returns (job, created), where job is the existing one if not created.
+    # The job does not run until submit() is called, so the caller can answer
+    # the request before the hotspot goes down.
+    def create(self, ssid: str) -> tuple[ConnectJob, bool]:
+        with self._lock:
+            if self._current is not None and not self._current.done:
+                return self._current, False
+            job = ConnectJob(ssid)
+            self._current = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOBS:
+                self._jobs.popitem(last=False)
+            return job, True
+
+    # True while a job is queued or running.
+    def busy(self) -> bool:
+        with self._lock:
+            return self._current is not None and not self._current.done
+
+    def submit(self, job: ConnectJob, **params) -> None:
+        self._queue.put((job, params))
+
+    def get(self, job_id: str) -> ConnectJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _worker(self) -> None:
+        netman.init_thread_bus()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            job, params = item
+            try:
+                success = self._run(job, **params)
+            except Exception as e:
+                logger.error(f'connect job {job.id} failed: {e}')
+                success = False
+            job.finish(success)
@@ -0,0 +1,349 @@
+# Index of the NetworkManager connection profiles.
+#
+# The profiles are read once, one concurrent GetSettings per profile, and the
+# index is then kept current from the Settings NewConnection and
+# ConnectionRemoved signals and the per-profile Updated signal, instead of
+# walking every profile each time we look for one.
+#
+# Signals need an event loop, so the index runs its own loop and bus in a
+# background thread.  Lookups are plain dict reads under a lock and may be
+# made from any thread.
+
+import asyncio, threading
+import logging
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import sdbus
+from nm_async import (
+    NetworkManagerSettings,
+    NetworkConnectionSettings,
+)
+
+logger = logging.getLogger('wifi-connect')
+
+LOAD_TIMEOUT = 10 # seconds to wait for the first load of the profiles
+DELETE_TIMEOUT = 10 # seconds to wait for NM to confirm profiles are removed
+
+
+#------------------------------------------------------------------------------
+# The parts of one profile we look profiles up by.
+@dataclass(slots=True)
+class ConnectionRecord:
+    path: str
+    uuid: str
+    id: str
+    type: str # e.g. '802-11-wireless'
+    interface_name: str # '' if the profile may be used on any interface
+    timestamp: int # last activation, 0 if never activated
+
+    @classmethod
+    def from_settings(cls, path: str, settings: dict) -> 'ConnectionRecord':
+        connection = settings.get('connection', {})
+
+        def value(key, default):
+            return connection[key][1] if key in connection else default
+
+        return cls(path,
+                   value('uuid', ''),
+                   value('id', ''),
+                   value('type', ''),
+                   value('interface-name', ''),
+                   value('timestamp', 0))
+
+
+#------------------------------------------------------------------------------
+# A set of records keyed by uuid, most recently activated first (profiles
+# that were never activated last, in the order NM lists them).
+class ConnectionRecords:
+    __slots__ = ('_records',)
+
+    def __init__(self, records: Iterable[ConnectionRecord] = ()):
+        self._records = {r.uuid: r for r in
+                sorted(records, key=lambda r: r.timestamp, reverse=True)}
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def __contains__(self, uuid: str) -> bool:
+        return uuid in self._records
+
+    def __getitem__(self, uuid: str) -> ConnectionRecord:
+        return self._records[uuid]
+
+    def get(self, uuid: str) -> ConnectionRecord | None:
+        return self._records.get(uuid)
+
+    def uuids(self) -> list[str]:
+        return list(self._records)
+
+    def with_id(self, connection_id: str) -> 'ConnectionRecords':
+        return ConnectionRecords(r for r in self if r.id == connection_id)
+
+    def __repr__(self) -> str:
+        return f'ConnectionRecords({list(self._records.values())})'
+
+
+#------------------------------------------------------------------------------
+# Fetch the records for a list of profile paths, all at once.  Profiles that
+# are removed while we ask are left out.
+async def fetch_records(connection_paths: list[str], bus) -> list[ConnectionRecord]:
+
+    async def fetch(path):
+        settings = await NetworkConnectionSettings(path, bus).get_settings()
+        return ConnectionRecord.from_settings(path, settings)
+
+    results = await asyncio.gather(*(fetch(path) for path in connection_paths),
+            return_exceptions=True)
+    return [r for r in results if isinstance(r, ConnectionRecord)]
+
+
+#------------------------------------------------------------------------------
+class ConnectionIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_path = {}
+        self._by_uuid = {}
+        # Buckets of {path: record}, so a lookup only looks at the profiles
+        # that can match.  '' in _by_interface holds the profiles usable on
+        # any interface.
+        self._by_id = defaultdict(dict)
+        self._by_type = defaultdict(dict)
+        self._by_interface = defaultdict(dict)
+        # NM never reuses a profile path, so a removed one stays removed even
+        # if a fetch for it started earlier completes after the signal.  Only
+        # paths with a fetch in flight need remembering.
+        self._removed = set()
+        self._fetching = Counter() # path: fetches in flight
+        self._ready = threading.Event()
+        self._removal_waiters = {} # path: [future], used on the loop only
+        self._thread = None
+        self.loop = None # the index's event loop, once started
+        self.bus = None # the bus the loop uses
+
+    #--------------------------------------------------------------------------
+    # Start the background thread and wait (up to timeout seconds) until the
+    # profiles are loaded.  Returns True if they are.
+    def start(self, timeout: float = LOAD_TIMEOUT) -> bool:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                    name='connection-index', daemon=True)
+            self._thread.start()
+        if not self._ready.wait(timeout):
+            logger.error(f'Connection profiles not loaded after {timeout}s')
+            return False
+        return True
+
+    #--------------------------------------------------------------------------
+    # Lookups.
+    def get_by_uuid(self, uuid: str) -> ConnectionRecord | None:
+        with self._lock:
+            return self._by_uuid.get(uuid)
+
+    def get_by_id(self, connection_id: str) -> ConnectionRecords:
+        return self.find(connection_id=connection_id)
+
+    # Return the records matching all the arguments given.  A profile
+    # without an interface name matches any interface.
+    def find(self, connection_type: str | None = None,
+            interface: str | None = None,
+            connection_id: str | None = None) -> ConnectionRecords:
+        with self._lock:
+            if connection_id is not None:
+                records = list(self._by_id.get(connection_id, {}).values())
+            elif connection_type is not None:
+                records = list(self._by_type.get(connection_type, {}).values())
+            elif interface is not None:
+                records = list(self._by_interface.get(interface, {}).values()) \
+                        + list(self._by_interface.get('', {}).values())
+            else:
+                records = list(self._by_path.values())
+        return ConnectionRecords(r for r in records
+                if (connection_type is None or r.type == connection_type)
+                and (interface is None or not r.interface_name
+                     or r.interface_name == interface)
+                and (connection_id is None or r.id == connection_id))
+
+    #--------------------------------------------------------------------------
+    # Keep the index current.  Called with the lock held.
+    def _add(self, record: ConnectionRecord) -> None:
+        self._discard(record.path)
+        self._by_path[record.path] = record
+        self._by_uuid[record.uuid] = record
+        self._by_id[record.id][record.path] = record
+        self._by_type[record.type][record.path] = record
+        self._by_interface[record.interface_name][record.path] = record
+
+    def _discard(self, path: str) -> None:
+        record = self._by_path.pop(path, None)
+        if record is None:
+            return
+        if self._by_uuid.get(record.uuid) is record:
+            del self._by_uuid[record.uuid]
+        for buckets, key in ((self._by_id, record.id),
+                (self._by_type, record.type),
+                (self._by_interface, record.interface_name)):
+            bucket = buckets[key]
+            bucket.pop(path, None)
+            if not bucket:
+                del buckets[key]
+
+    # Fetch the records for paths and add them: all of them (new), only
+    # those already indexed (updated), or only those not yet indexed (the
+    # first load, which signals may have overtaken).
+    async def _fetch(self, paths: list[str], mode: str = 'new') -> list[ConnectionRecord]:
+        with self._lock:
+            self._fetching.update(paths)
+        try:
+            records = await fetch_records(paths, self.bus)
+        finally:
+            with self._lock:
+                self._fetching.subtract(paths)
+                self._fetching += Counter() # drop the zero counts
+                added = []
+                for record in records:
+                    if record.path in self._removed:
+                        continue
+                    known = record.path in self._by_path
+                    if (mode == 'updated' and not known) or \
+                            (mode == 'load' and known):
+                        continue
+                    self._add(record)
+                    added.append(record)
+                # Nothing can bring these back any more.
+                self._removed.difference_update(
+                        [p for p in paths if p not in self._fetching])
+        return added
+
+    def _remove(self, path: str) -> None:
+        with self._lock:
+            self._discard(path)
+            if path in self._fetching:
+                self._removed.add(path)
+        for waiter in self._removal_waiters.pop(path, []):
+            if not waiter.done():
+                waiter.set_result(path)
+
+    #--------------------------------------------------------------------------
+    # Delete the profiles with the given uuids, all at once, and wait until NM
+    # has signalled that each is gone, or timeout seconds have passed.
+    # Returns the uuids that were removed.
+    def delete_many(self, uuids: Iterable[str],
+            timeout: float = DELETE_TIMEOUT) -> list[str]:
+        uuids = list(uuids)
+        if not uuids or not self._running():
+            return []
+        future = asyncio.run_coroutine_threadsafe(
+                self._delete_many(uuids, timeout), self.loop)
+        return future.result()
+
+    # The same, for a caller running its own event loop.
+    async def delete_many_async(self, uuids: Iterable[str],
+            timeout: float = DELETE_TIMEOUT) -> list[str]:
+        uuids = list(uuids)
+        if not uuids or not self._running():
+            return []
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+                self._delete_many(uuids, timeout), self.loop))
+
+    def _running(self) -> bool:
+        if self.loop is None or not self.loop.is_running():
+            logger.error('Connection index is not running')
+            return False
+        return True
+
+    async def _delete_many(self, uuids: list[str], timeout: float) -> list[str]:
+        with self._lock:
+            paths = {uuid: self._by_uuid[uuid].path for uuid in uuids
+                    if uuid in self._by_uuid}
+        for uuid in uuids:
+            if uuid not in paths:
+                logger.warning(f'delete_many: no connection profile {uuid}')
+
+        # Wait for the signal rather than the Delete() reply, NM sends the
+        # reply before it has finished tearing the profile down.
+        waiters = {}
+        for uuid, path in paths.items():
+            waiters[uuid] = self.loop.create_future()
+            self._removal_waiters.setdefault(path, []).append(waiters[uuid])
+
+        results = await asyncio.gather(
+                *(NetworkConnectionSettings(path, self.bus).delete()
+                    for path in paths.values()),
+                return_exceptions=True)
+        for (uuid, path), result in zip(paths.items(), results):
+            if isinstance(result, Exception):
+                logger.error(f'Could not delete connection profile {uuid}: {result}')
+                waiters.pop(uuid).cancel()
+
+        if waiters:
+            done, pending = await asyncio.wait(waiters.values(), timeout=timeout)
+            for waiter in pending:
+                waiter.cancel()
+            if pending:
+                logger.warning(f'{len(pending)} connection profiles not removed after {timeout}s')
+        for path in paths.values():
+            self._removal_waiters.pop(path, None)
+        return [uuid for uuid, waiter in waiters.items()
+                if waiter.done() and not waiter.cancelled()]
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._main())
+        except Exception as e:
+            logger.error(f'Connection index stopped: {e}')
+        finally:
+            self._ready.set() # do not leave start() waiting
+
+    async def _main(self) -> None:
+        self.bus = sdbus.sd_bus_open_system()
+        settings = NetworkManagerSettings(self.bus)
+
+        async def watch_new():
+            async for path in settings.new_connection:
+                for record in await self._fetch([path]):
+                    logger.debug(f'Connection profile added: {record.id} {record.uuid}')
+
+        async def watch_removed():
+            async for path in settings.connection_removed:
+                self._remove(path)
+                logger.debug(f'Connection profile removed: {path}')
+
+        async def watch_updated():
+            async for path, _ in NetworkConnectionSettings.updated.catch_anywhere(
+                    'org.freedesktop.NetworkManager', self.bus):
+                await self._fetch([path], 'updated')
+
+        watchers = [asyncio.create_task(watch_new()),
+                    asyncio.create_task(watch_removed()),
+                    asyncio.create_task(watch_updated())]
+
+        # Subscribe before reading the list, see
+        # nm_events.wait_for_activation().
+        await asyncio.sleep(0)
+        records = await self._fetch(await settings.connections, 'load')
+        logger.debug(f'Indexed {len(records)} connection profiles')
+        self._ready.set()
+
+        await asyncio.gather(*watchers)
+
+
+#------------------------------------------------------------------------------
+# The index shared by the whole process, started on first use.
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> ConnectionIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ConnectionIndex()
+            _index.start()
+        return _index
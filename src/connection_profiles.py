@@ -0,0 +1,145 @@
+# NetworkManager connection settings dicts for the connections we create.
+# Shared by the blocking (netman) and asyncio (async_netman) implementations.
+
+import uuid
+
+
+HOTSPOT_CONNECTION_NAME = 'dawnlite'
+GENERIC_CONNECTION_NAME = 'python-wifi-connect'
+HOTSPOT_ADDRESS = '192.168.42.1'
+
+
+#------------------------------------------------------------------------------
+# Supported connection types for build_connection_dict().
+CONN_TYPE_HOTSPOT        = 'hotspot'
+CONN_TYPE_SEC_NONE       = 'NONE' # MIT
+CONN_TYPE_SEC_PASSWORD   = 'PASSWORD' # WPA and WPA2
+CONN_TYPE_SEC_WEP        = 'WEP'
+CONN_TYPE_SEC_ENTERPRISE = 'ENTERPRISE' # MIT SECURE
+CONN_TYPE_SEC_SAE        = 'SAE' # WPA3 personal
+CONN_TYPE_SEC_OWE        = 'OWE' # Enhanced Open
+
+
+#------------------------------------------------------------------------------
+# Build the settings dict AddConnection (or Update2) expects for one of the
+# connection types above.
+# band ('bg' or 'a'), channel (0 lets NM pick) and address are only used for
+# the hotspot.  With interface (e.g. 'wlan0') the profile may only be used on
+# that device.
+# Returns (settings dict, display string), or (None, '') for an unknown type.
+def build_connection_dict(conn_type, conn_name, ssid, username=None, password=None,
+        band='bg', channel=0, address=HOTSPOT_ADDRESS, interface=None):
+    bSSID = ssid.encode('utf-8')
+
+    if conn_type == CONN_TYPE_HOTSPOT:
+        # This is the hotspot that we turn on, on the RPI so we can show our
+        # captured portal to let the user select an AP and provide credentials.
+        hotspot_dict = {
+            '802-11-wireless': {'band': ('s', band),
+                                'mode': ('s','ap'),
+                                'ssid': ('ay', bSSID)},
+            'connection': {'autoconnect': ('b', False),
+                           'id': ('s', conn_name),
+                           'type': ('s','802-11-wireless'),
+                           'uuid': ('s', str(uuid.uuid4()))},
+            'ipv4': {'address-data': ('aa{sv}',
+                        [{'address': ('s', address), 'prefix': ('u',24)}]),
+                     'method': ('s','manual')},
+            'ipv6': {'method': ('s','auto')}
+        }
+        if channel:
+            hotspot_dict['802-11-wireless']['channel'] = ('u', channel)
+        return bind_to_interface(hotspot_dict, interface), 'HOTSPOT'
+
+# debugrob: is this realy a generic ENTERPRISE config, need another?
+# debugrob: how do we handle connecting to a captured portal?
+
+    if conn_type == CONN_TYPE_SEC_ENTERPRISE:
+        # This is what we use for "MIT SECURE" network.
+        enterprise_dict = {
+            '802-11-wireless': {'mode': ('s','infrastructure'),
+                                'security': ('s','802-11-wireless-security'),
+                                'ssid': ('ay',bSSID)},
+            '802-11-wireless-security':
+                {'auth-alg': ('s','open'), 'key-mgmt': ('s','wpa-eap')},
+            '802-1x': {'eap': ('as', ['peap']),
+                       'identity':('s', username if username != None else ""),
+                       'password': ('s', password if password != None else ""),
+                       'phase2-auth': ('s','mschapv2')},
+            'connection': {'id': ('s',conn_name),
+                           'type': ('s', '802-11-wireless'),
+                           'uuid': ('s', str(uuid.uuid4()))},
+            'ipv4': {'method': ('s','auto')},
+            'ipv6': {'method': ('s','auto')}
+        }
+        return bind_to_interface(enterprise_dict, interface), 'ENTERPRISE'
+
+    if conn_type in (CONN_TYPE_SEC_NONE, CONN_TYPE_SEC_OWE):
+        # No auth, 'open' connection.
+        none_dict = {
+            '802-11-wireless': {'mode': ('s','infrastructure'),
+                                'ssid': ('ay', bSSID)},
+            'connection': {'id': ('s',conn_name),
+                           'type': ('s','802-11-wireless'),
+                           'uuid': ('s',str(uuid.uuid4()))},
+            'ipv4': {'method': ('s','auto')},
+            'ipv6': {'method': ('s','auto')}
+        }
+        if conn_type == CONN_TYPE_SEC_OWE:
+            # Still no password, but the traffic is encrypted.
+            none_dict['802-11-wireless']['security'] = ('s','802-11-wireless-security')
+            none_dict['802-11-wireless-security'] = {'key-mgmt': ('s','owe')}
+            return bind_to_interface(none_dict, interface), 'OWE'
+        return bind_to_interface(none_dict, interface), 'OPEN'
+
+    if conn_type in (CONN_TYPE_SEC_PASSWORD, CONN_TYPE_SEC_SAE):
+        # Hidden, WPA, WPA2, WPA3, password required.
+        key_mgmt = 'sae' if conn_type == CONN_TYPE_SEC_SAE else 'wpa-psk'
+        passwd_dict = {
+            '802-11-wireless': {'mode': ('s','infrastructure'),
+                                'security': ('s','802-11-wireless-security'),
+                                'ssid': ('ay', bSSID)},
+            '802-11-wireless-security':
+                {'key-mgmt': ('s', key_mgmt), 'psk': ('s', password if password != None else '')},
+            'connection': {'id': ('s', conn_name),
+                        'type': ('s','802-11-wireless'),
+                        'uuid': ('s', str(uuid.uuid4())),
+                        },
+            'ipv4': {'method': ('s', 'auto')},
+            'ipv6': {'method': ('s', 'auto')}
+        }
+        if conn_type == CONN_TYPE_SEC_SAE:
+            return bind_to_interface(passwd_dict, interface), 'WPA3'
+        return bind_to_interface(passwd_dict, interface), 'WPA/WPA2'
+
+    if conn_type == CONN_TYPE_SEC_WEP:
+        # WEP has no key management, the key goes in wep-key0 as is: 5 or 13
+        # characters, or 10 or 26 hex digits (wep-key-type 1).
+        wep_dict = {
+            '802-11-wireless': {'mode': ('s','infrastructure'),
+                                'security': ('s','802-11-wireless-security'),
+                                'ssid': ('ay', bSSID)},
+            '802-11-wireless-security':
+                {'key-mgmt': ('s', 'none'),
+                 'auth-alg': ('s', 'open'),
+                 'wep-key-type': ('u', 1),
+                 'wep-tx-keyidx': ('u', 0),
+                 'wep-key0': ('s', password if password != None else '')},
+            'connection': {'id': ('s', conn_name),
+                        'type': ('s','802-11-wireless'),
+                        'uuid': ('s', str(uuid.uuid4())),
+                        },
+            'ipv4': {'method': ('s', 'auto')},
+            'ipv6': {'method': ('s', 'auto')}
+        }
+        return bind_to_interface(wep_dict, interface), 'WEP'
+
+    return None, ''
+
+
+#------------------------------------------------------------------------------
+# Restrict a profile to one interface, or leave it usable on any if None.
+def bind_to_interface(conn_dict, interface=None):
+    if interface:
+        conn_dict['connection']['interface-name'] = ('s', interface)
+    return conn_dict
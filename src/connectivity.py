@@ -0,0 +1,164 @@
+# Check if we have a working internet connection.
+#
+# Several probes race each other and the first one that succeeds answers:
+# TCP connects to well known hosts, HTTP GETs of a URL that answers 204 No
+# Content (a captive portal answers with something else), and NetworkManager's
+# own connectivity check.  Every socket has its own timeout and is closed, and
+# the answer is cached for a few seconds, so callers may ask often.
+#
+# The targets are arguments, so the checker can be pointed at local listeners.
+
+import asyncio, threading, time
+import logging
+from urllib.parse import urlsplit
+
+from nm_async import NetworkManager
+from sdbus_async.networkmanager.enums import NetworkManagerConnectivityState
+from nm_events import run_on_private_bus
+
+logger = logging.getLogger('wifi-connect')
+
+TCP_TARGETS = ['8.8.8.8:53', '1.1.1.1:53']
+HTTP_URLS = ['http://connectivitycheck.gstatic.com/generate_204']
+TIMEOUT = 2 # seconds for each probe
+CACHE_TTL = 5 # seconds an answer is reused
+
+
+#------------------------------------------------------------------------------
+# Split 'host:port' into (host, port).
+def parse_target(target: str) -> tuple[str, int]:
+    host, _, port = target.rpartition(':')
+    return host.strip('[]'), int(port)
+
+
+#------------------------------------------------------------------------------
+# The probes.  Each returns True on success, False or an exception on failure.
+async def tcp_probe(host: str, port: int, timeout: float) -> bool:
+    reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), timeout)
+    writer.close()
+    await writer.wait_closed()
+    return True
+
+
+async def http_probe(url: str, timeout: float) -> bool:
+    parts = urlsplit(url)
+    https = parts.scheme == 'https'
+    port = parts.port or (443 if https else 80)
+
+    async def get():
+        reader, writer = await asyncio.open_connection(parts.hostname, port,
+                ssl=https or None)
+        try:
+            writer.write(f'GET {parts.path or "/"} HTTP/1.1\r\n'
+                         f'Host: {parts.hostname}\r\n'
+                         f'Connection: close\r\n\r\n'.encode('ascii'))
+            await writer.drain()
+            status_line = await reader.readline()
+        finally:
+            writer.close()
+        # b'HTTP/1.1 204 No Content'
+        return status_line.split()[1:2] == [b'204']
+
+    return await asyncio.wait_for(get(), timeout)
+
+
+# Without its check enabled NM reports FULL for any default route, so that
+# does not count.
+async def nm_probe(bus, timeout: float) -> bool:
+    nm = NetworkManager(bus)
+
+    async def check():
+        if not await nm.connectivity_check_enabled:
+            return False
+        return await nm.check_connectivity() == NetworkManagerConnectivityState.FULL
+
+    return await asyncio.wait_for(check(), timeout)
+
+
+#------------------------------------------------------------------------------
+class ConnectivityChecker:
+
+    def __init__(self, tcp_targets: list[str] = TCP_TARGETS,
+            http_urls: list[str] = HTTP_URLS, use_nm: bool = True,
+            timeout: float = TIMEOUT, ttl: float = CACHE_TTL):
+        self.tcp_targets = [parse_target(t) for t in tcp_targets]
+        self.http_urls = list(http_urls)
+        self.use_nm = use_nm
+        self.timeout = timeout
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._result = None
+        self._checked = 0.0 # time.monotonic() of the cached result
+
+    #--------------------------------------------------------------------------
+    # Return True if any probe succeeds, from the cache if the last answer is
+    # younger than the TTL.  Blocking; opens its own bus for the NM probe.
+    def check(self) -> bool:
+        cached = self.cached()
+        if cached is not None:
+            return cached
+        if self.use_nm:
+            return run_on_private_bus(self.check_async)
+        return asyncio.run(self.check_async())
+
+    # The same, for a caller running its own event loop.
+    async def check_async(self, bus=None) -> bool:
+        cached = self.cached()
+        if cached is not None:
+            return cached
+        start = time.monotonic()
+        result, winner = await self._race(bus)
+        with self._lock:
+            self._result = result
+            self._checked = time.monotonic()
+        if result:
+            logger.debug(f'Internet reachable via {winner} after {time.monotonic() - start:.2f}s')
+        else:
+            logger.info(f'No internet connection ({time.monotonic() - start:.2f}s)')
+        return result
+
+    def cached(self) -> bool | None:
+        with self._lock:
+            if self._result is not None and \
+                    time.monotonic() - self._checked < self.ttl:
+                return self._result
+        return None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._result = None
+
+    #--------------------------------------------------------------------------
+    # Run all probes at once, return (True, probe name) for the first that
+    # succeeds, or (False, None) once all have failed.
+    async def _race(self, bus) -> tuple[bool, str | None]:
+        probes = {}
+        for host, port in self.tcp_targets:
+            probes[f'tcp {host}:{port}'] = tcp_probe(host, port, self.timeout)
+        for url in self.http_urls:
+            probes[f'http {url}'] = http_probe(url, self.timeout)
+        if self.use_nm and bus is not None:
+            probes['NetworkManager'] = nm_probe(bus, self.timeout)
+
+        tasks = {asyncio.create_task(probe): name for name, probe in probes.items()}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending,
+                        return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result():
+                        return True, tasks[task]
+                    logger.debug(f'Connectivity probe {tasks[task]} failed: {task.exception() or "unexpected answer"}')
+            return False, None
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+            # Retrieve the failures we did not look at, so asyncio does not
+            # log them as never retrieved.
+            for task in tasks:
+                if not task.cancelled():
+                    task.exception()
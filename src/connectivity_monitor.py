@@ -0,0 +1,146 @@
+# Follow NetworkManager's global Connectivity and State properties.
+#
+# NM signals every change with PropertiesChanged, so we know within a moment
+# when the device gets (or loses) its internet connection, without polling.
+# When NM says we are online, the connectivity checker confirms it before we
+# believe it.  Going offline is believed at once, callers that want
+# hysteresis wait for it to last (see wait_offline()).
+#
+# Like the connection_index, the monitor runs its own loop and bus in a
+# background thread; the waits may be made from any thread.
+
+import asyncio, threading, time
+import logging
+
+import sdbus
+from nm_async import NetworkManager
+from sdbus_async.networkmanager.enums import (
+    NetworkManagerConnectivityState,
+    NetworkManagerState,
+)
+
+from connectivity import ConnectivityChecker
+from nm_events import to_enum
+
+logger = logging.getLogger('wifi-connect')
+
+RECHECK_INTERVAL = 10 # seconds between checks while NM says online and the checker does not
+
+
+#------------------------------------------------------------------------------
+# True if NM thinks we have internet access.  Without its connectivity check
+# NM reports both for any default route, hence the confirmation.
+def nm_says_online(connectivity: int, state: int) -> bool:
+    return connectivity == NetworkManagerConnectivityState.FULL \
+            or state == NetworkManagerState.GLOBAL
+
+
+#------------------------------------------------------------------------------
+class ConnectivityMonitor:
+
+    def __init__(self, checker: ConnectivityChecker):
+        self.checker = checker
+        self._changed = threading.Condition()
+        self._online = False
+        self._since = time.monotonic() # of the last change of _online
+        self._ready = threading.Event()
+        self._thread = None
+        self.connectivity = NetworkManagerConnectivityState.UNKNOWN
+        self.state = NetworkManagerState.UNKNOWN
+
+    #--------------------------------------------------------------------------
+    # Start the background thread and wait (up to timeout seconds) until we
+    # know if we are online.  Returns True if we do.
+    def start(self, timeout: float = 10) -> bool:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                    name='connectivity-monitor', daemon=True)
+            self._thread.start()
+        return self._ready.wait(timeout)
+
+    @property
+    def online(self) -> bool:
+        with self._changed:
+            return self._online
+
+    #--------------------------------------------------------------------------
+    # Block until we are online, or timeout seconds (None for no limit) have
+    # passed.  Returns True if we are online.
+    def wait_online(self, timeout: float | None = None) -> bool:
+        with self._changed:
+            return self._changed.wait_for(lambda: self._online, timeout)
+
+    # Block until we have been offline for grace seconds without a break.
+    def wait_offline(self, grace: float) -> None:
+        with self._changed:
+            while True:
+                self._changed.wait_for(lambda: not self._online)
+                remaining = self._since + grace - time.monotonic()
+                if remaining <= 0:
+                    return
+                # Back online within the grace period starts it again.
+                self._changed.wait_for(lambda: self._online, remaining)
+
+    #--------------------------------------------------------------------------
+    def _set_online(self, online: bool) -> None:
+        with self._changed:
+            if online == self._online:
+                return
+            self._online = online
+            self._since = time.monotonic()
+            self._changed.notify_all()
+        state = getattr(self.state, 'name', self.state)
+        connectivity = getattr(self.connectivity, 'name', self.connectivity)
+        logger.info(f'Internet connection {"up" if online else "down"} (NM state={state} connectivity={connectivity})')
+
+    def _run(self) -> None:
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            logger.error(f'Connectivity monitor stopped: {e}')
+        finally:
+            self._ready.set() # do not leave start() waiting
+
+    async def _main(self) -> None:
+        bus = sdbus.sd_bus_open_system()
+        nm = NetworkManager(bus)
+        changed = asyncio.Event()
+
+        async def watch():
+            async for _, properties, _ in nm.properties_changed:
+                if 'Connectivity' in properties:
+                    self.connectivity = to_enum(NetworkManagerConnectivityState,
+                            properties['Connectivity'][1])
+                if 'State' in properties:
+                    self.state = to_enum(NetworkManagerState,
+                            properties['State'][1])
+                if 'Connectivity' in properties or 'State' in properties:
+                    changed.set()
+
+        watcher = asyncio.create_task(watch())
+
+        # Subscribe before reading, see nm_events.wait_for_activation().
+        await asyncio.sleep(0)
+        connectivity, state = await asyncio.gather(nm.connectivity, nm.state)
+        self.connectivity = to_enum(NetworkManagerConnectivityState, connectivity)
+        self.state = to_enum(NetworkManagerState, state)
+
+        while not watcher.done():
+            changed.clear()
+            if nm_says_online(self.connectivity, self.state):
+                # NM's answer may be old or optimistic, ask the checker.
+                self.checker.invalidate()
+                self._set_online(await self.checker.check_async(bus))
+            else:
+                self._set_online(False)
+            self._ready.set()
+
+            timeout = None if self.online or \
+                    not nm_says_online(self.connectivity, self.state) \
+                    else RECHECK_INTERVAL
+            waiter = asyncio.create_task(changed.wait())
+            await asyncio.wait({watcher, waiter}, timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+
+        watcher.result() # raise what stopped it
@@ -0,0 +1,123 @@
+# Checks on what the user typed into the portal form, made before we try to
+# connect.
+#
+# A connection attempt with a password NM can never accept still costs the
+# user a full attempt (and, with one radio, the hotspot going down and up
+# again), so input that can not be right is rejected here, with a message
+# the UI shows next to the form.
+
+import string
+
+from ap_security import (
+    SECURITY_WEP,
+    SECURITY_WPA,
+    SECURITY_WPA2,
+    SECURITY_WPA3,
+    SECURITY_ENTERPRISE,
+)
+
+MAX_SSID_LENGTH = 32 # bytes
+PSK_MIN_LENGTH = 8 # WPA passphrase, printable ASCII
+PSK_MAX_LENGTH = 63
+PSK_HEX_LENGTH = 64 # a raw WPA key, as hex
+WEP_ASCII_LENGTHS = (5, 13) # 64 and 128 bit keys
+WEP_HEX_LENGTHS = (10, 26)
+
+# security types (of a cached SSID) that need a WPA passphrase, a WPA3 (SAE)
+# password of any length, or a username and password
+NEEDS_PSK = (SECURITY_WPA, SECURITY_WPA2)
+NEEDS_PASSWORD = (SECURITY_WPA3,)
+NEEDS_IDENTITY = (SECURITY_ENTERPRISE,)
+
+
+def is_hex(value: str) -> bool:
+    return all(c in string.hexdigits for c in value)
+
+
+def is_printable_ascii(value: str) -> bool:
+    return all(' ' <= c <= '~' for c in value)
+
+
+#------------------------------------------------------------------------------
+# Return the security type of an SSID in the list we sent to the portal, or
+# None if it is not in the list.
+def lookup_security(ssids: list, ssid: str) -> str | None:
+    ssid_bytes = ssid.encode('utf-8')
+    for entry in ssids:
+        if entry['ssid'] == ssid_bytes or entry['ssid'] == ssid:
+            return entry['security']
+    return None
+
+
+#------------------------------------------------------------------------------
+# Return an error message for a WPA pre-shared key, or None if it is valid.
+def check_psk(password: str) -> str | None:
+    if len(password) == PSK_HEX_LENGTH and is_hex(password):
+        return None
+    if not PSK_MIN_LENGTH <= len(password) <= PSK_MAX_LENGTH:
+        return f'The password must be {PSK_MIN_LENGTH} to {PSK_MAX_LENGTH} characters long.'
+    if not is_printable_ascii(password):
+        return 'The password may only contain letters, digits, spaces and punctuation.'
+    return None
+
+
+#------------------------------------------------------------------------------
+# Return an error message for a WEP key, or None if it is valid.
+def check_wep_key(password: str) -> str | None:
+    if len(password) in WEP_HEX_LENGTHS and is_hex(password):
+        return None
+    if len(password) in WEP_ASCII_LENGTHS and is_printable_ascii(password):
+        return None
+    return 'A WEP key is 5 or 13 characters, or 10 or 26 hex digits.'
+
+
+#------------------------------------------------------------------------------
+# Return the security to connect to a hidden network with, which we can not
+# look up: WPA2 for anything that may be a WPA passphrase, WEP only for a key
+# that can not be one (a WPA2 profile also connects to WPA networks).
+def hidden_security(password: str | None) -> str:
+    password = password or ''
+    if check_psk(password) is not None and check_wep_key(password) is None:
+        return SECURITY_WEP
+    return SECURITY_WPA2
+
+
+#------------------------------------------------------------------------------
+# Check the form input for a connection to ssid.  ssids is the list we sent
+# to the portal and hidden is True if the user typed in the name of a network
+# that is not in it.  Returns an error message, or None if the input may be
+# right.
+def check_credentials(ssids: list, ssid: str, username: str | None,
+        password: str | None, hidden: bool = False) -> str | None:
+    if not ssid:
+        return 'Please choose a network.'
+    if len(ssid.encode('utf-8')) > MAX_SSID_LENGTH:
+        return f'A network name is at most {MAX_SSID_LENGTH} bytes long.'
+
+    password = password or ''
+    if hidden:
+        # We do not know the security of a hidden network, so take any
+        # password it could have.
+        if check_psk(password) and check_wep_key(password):
+            return check_psk(password)
+        return None
+
+    security = lookup_security(ssids, ssid)
+    if security is None:
+        if not ssids:
+            return None # the scan found nothing, let NM decide
+        return f'The network {ssid} is no longer in range, please choose another.'
+
+    if security in NEEDS_IDENTITY:
+        if not username:
+            return 'Please enter your username.'
+        if not password:
+            return 'Please enter your password.'
+    elif security == SECURITY_WEP:
+        return check_wep_key(password)
+    elif security in NEEDS_PSK:
+        return check_psk(password)
+    elif security in NEEDS_PASSWORD:
+        if not password:
+            return 'Please enter your password.'
+    return None
@@ -0,0 +1,206 @@
+# Registry of the NetworkManager devices.
+#
+# The devices are enumerated once, their properties read concurrently, and
+# the registry is then kept current from the NetworkManager DeviceAdded and
+# DeviceRemoved signals and the per-device StateChanged signal, instead of
+# walking every device and reading its properties one call at a time each
+# time we look for the wifi device.
+#
+# Like the connection_index, it runs its own loop and bus in a background
+# thread, and lookups are plain dict reads under a lock.
+
+import asyncio, threading
+import logging
+from dataclasses import dataclass
+
+import sdbus
+from sdbus import DbusFailedError
+from nm_async import (
+    NetworkManager,
+    NetworkDeviceGeneric,
+    NetworkDeviceWireless,
+)
+from sdbus_async.networkmanager.enums import DeviceType
+
+logger = logging.getLogger('wifi-connect')
+
+LOAD_TIMEOUT = 10 # seconds to wait for the first load of the devices
+
+
+#------------------------------------------------------------------------------
+# The parts of one device we use.
+@dataclass(slots=True)
+class DeviceRecord:
+    path: str
+    interface: str # e.g. 'wlan0'
+    device_type: int # DeviceType
+    managed: bool
+    state: int # DeviceState
+    ip4_config: str # '/' if the device has no ip4 config
+    active_connection: str # '/' if none
+    wireless_capabilities: int # WifiCapabilities, 0 for other devices
+
+    @property
+    def is_wifi(self) -> bool:
+        return self.device_type == DeviceType.WIFI
+
+
+#------------------------------------------------------------------------------
+# Read the record of one device, all properties at once.  Returns None if the
+# device is removed while we ask.
+async def fetch_device(path: str, bus) -> DeviceRecord | None:
+    device = NetworkDeviceGeneric(path, bus)
+    try:
+        interface, device_type, managed, state, ip4_config, active_connection = \
+                await asyncio.gather(device.interface, device.device_type,
+                        device.managed, device.state, device.ip4_config,
+                        device.active_connection)
+        capabilities = 0
+        if device_type == DeviceType.WIFI:
+            capabilities = await NetworkDeviceWireless(path, bus).wireless_capabilities
+    except DbusFailedError:
+        return None
+    return DeviceRecord(path, interface, device_type, managed, state,
+            ip4_config, active_connection, capabilities)
+
+
+#------------------------------------------------------------------------------
+class DeviceRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_path = {}
+        # NM never reuses a device path, see ConnectionIndex._removed.
+        self._removed = set()
+        self._ready = threading.Event()
+        self._thread = None
+        self.loop = None # the registry's event loop, once started
+        self.bus = None # the bus the loop uses
+
+    #--------------------------------------------------------------------------
+    # Start the background thread and wait (up to timeout seconds) until the
+    # devices are loaded.  Returns True if they are.
+    def start(self, timeout: float = LOAD_TIMEOUT) -> bool:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                    name='device-registry', daemon=True)
+            self._thread.start()
+        if not self._ready.wait(timeout):
+            logger.error(f'Devices not loaded after {timeout}s')
+            return False
+        return True
+
+    #--------------------------------------------------------------------------
+    # Lookups.
+    def get(self, path: str) -> DeviceRecord | None:
+        with self._lock:
+            return self._by_path.get(path)
+
+    def get_by_interface(self, interface: str) -> DeviceRecord | None:
+        with self._lock:
+            for record in self._by_path.values():
+                if record.interface == interface:
+                    return record
+        return None
+
+    def devices(self) -> list[DeviceRecord]:
+        with self._lock:
+            return list(self._by_path.values())
+
+    # The managed wifi devices, in the order NM added them.  With
+    # configured_only, only those that have an ip4 config.
+    def wifi_devices(self, configured_only: bool = False) -> list[DeviceRecord]:
+        return [d for d in self.devices() if d.is_wifi and d.managed
+                and (not configured_only or d.ip4_config != '/')]
+
+    # The managed wifi device with the given interface name, or the first
+    # one if interface is empty.  None if there is no such device.
+    def wifi_device(self, interface: str = '') -> DeviceRecord | None:
+        for device in self.wifi_devices():
+            if not interface or device.interface == interface:
+                return device
+        return None
+
+    #--------------------------------------------------------------------------
+    # Keep the registry current.
+    def _put(self, record: DeviceRecord) -> None:
+        with self._lock:
+            if record.path in self._removed:
+                return
+            self._by_path[record.path] = record
+
+    def _remove(self, path: str) -> DeviceRecord | None:
+        with self._lock:
+            self._removed.add(path)
+            return self._by_path.pop(path, None)
+
+    async def _refresh(self, path: str) -> DeviceRecord | None:
+        record = await fetch_device(path, self.bus)
+        if record is not None:
+            self._put(record)
+        return record
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self._main())
+        except Exception as e:
+            logger.error(f'Device registry stopped: {e}')
+        finally:
+            self._ready.set() # do not leave start() waiting
+
+    async def _main(self) -> None:
+        self.bus = sdbus.sd_bus_open_system()
+        nm = NetworkManager(self.bus)
+
+        async def watch_added():
+            async for path in nm.device_added:
+                record = await self._refresh(path)
+                if record is not None:
+                    logger.info(f'Device added: {record.interface}')
+
+        async def watch_removed():
+            async for path in nm.device_removed:
+                record = self._remove(path)
+                if record is not None:
+                    logger.info(f'Device removed: {record.interface}')
+
+        async def watch_state():
+            # The ip4 config and active connection change with the state, so
+            # the whole record is read again.
+            async for path, _ in NetworkDeviceGeneric.state_changed.catch_anywhere(
+                    'org.freedesktop.NetworkManager', self.bus):
+                await self._refresh(path)
+
+        watchers = [asyncio.create_task(watch_added()),
+                    asyncio.create_task(watch_removed()),
+                    asyncio.create_task(watch_state())]
+
+        # Subscribe before reading the list, see
+        # nm_events.wait_for_activation().
+        await asyncio.sleep(0)
+        records = await asyncio.gather(
+                *(fetch_device(path, self.bus) for path in await nm.get_devices()))
+        with self._lock:
+            for record in records:
+                if record is not None and record.path not in self._removed:
+                    self._by_path.setdefault(record.path, record)
+        logger.debug(f'Registered devices: {[r.interface for r in records if r]}')
+        self._ready.set()
+
+        await asyncio.gather(*watchers)
+
+
+#------------------------------------------------------------------------------
+# The registry shared by the whole process, started on first use.
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> DeviceRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DeviceRegistry()
+            _registry.start()
+        return _registry
@@ -1,52 +1,314 @@
-# start / stop the dnsmasq process
+# Start, supervise and stop our dnsmasq process, or the built-in responder
+# (BUILTIN_RESPONDER in .env.global) that does its job without dnsmasq.
+#
+# The supervisor owns the child process: it stops it with SIGTERM (SIGKILL
+# only if it does not exit in time), restarts it with a growing delay if it
+# dies, and knows it is ready when its DNS and DHCP sockets are bound.  Only
+# our own dnsmasq is ever signalled, never the system's.
 
-import subprocess, time
+import os, signal, socket, subprocess, threading, time
 import logging
 
+from utility import get_config
+from captive_responder import CaptiveResponder
+
+CONFIG = get_config()
+
+DNSMASQ="/usr/sbin/dnsmasq"
 DEFAULT_GATEWAY="192.168.42.1"
 DEFAULT_DHCP_RANGE="192.168.42.2,192.168.42.254"
-DEFAULT_INTERFACE="wlan0" # use 'ip link show' to see list of interfaces
+DEFAULT_INTERFACE="wlan0" # used if the caller does not know the hotspot interface
+CACHE_SIZE = CONFIG.get('DNSMASQ_CACHE_SIZE', 1000) # DNS answers kept
+LOCAL_TTL = CONFIG.get('DNSMASQ_LOCAL_TTL', 10) # seconds clients may keep our captive DNS answers
+LEASE_FILE = CONFIG.get('DNSMASQ_LEASE_FILE', '/run/wifi-connect-dnsmasq.leases') # tmpfs, not the SD card
+LEASE_TIME = CONFIG.get('DNSMASQ_LEASE_TIME', '1h') # seconds, or with a unit: 10m, 1h
+MAX_LEASES = CONFIG.get('DNSMASQ_MAX_LEASES', 253)
+BUILTIN_RESPONDER = CONFIG.get('BUILTIN_RESPONDER') == 'True' # answer DNS and DHCP ourselves, see captive_responder
+PID_FILE = '/run/wifi-connect-dnsmasq.pid' # to stop the dnsmasq of a run that crashed
+START_TIMEOUT = 5 # seconds to wait for dnsmasq to listen
+STOP_TIMEOUT = 5 # seconds to wait for dnsmasq to exit after SIGTERM
+RESTART_DELAY = 1 # seconds before the first restart, doubled for each crash in a row
+MAX_RESTART_DELAY = 60
+STABLE_TIME = 60 # seconds dnsmasq must run before a crash counts as the first again
+POLL_INTERVAL = 0.05 # seconds between checks while waiting
+DNS_PORT = 53
+DHCP_PORT = 67
+TCP_LISTEN = '0A' # socket state in /proc/net/tcp
+
+# supervisor states
+STOPPED = 'stopped'
+STARTING = 'starting'
+RUNNING = 'running'
+RESTARTING = 'restarting'
 
 logger = logging.getLogger('wifi-connect')
 
-def stop():
-    #using awk instead of cut to extract the pid
-    ps = subprocess.Popen("ps -e | grep ' dnsmasq' | awk '{print $1}'", shell=True, stdout=subprocess.PIPE)
-    pid = ps.stdout.read()
-    ps.stdout.close()
-    ps.wait()
-    pid = pid.decode('utf-8')
-    pid = pid.strip()
-    if 0 < len(pid):
-        logger.info(f"Killing dnsmasq, PID='{pid}'")
-        ps = subprocess.Popen(f"kill -9 {pid}", shell=True)
-        ps.wait()
-
-
-def start():
-    # first kill any existing dnsmasq
-    stop()
-
-    # build the list of args
-    path = "/usr/sbin/dnsmasq"
-    args = [path]
+
+#------------------------------------------------------------------------------
+# The dnsmasq command line for the hotspot on interface, tuned from
+# .env.global.
+def build_args(interface: str) -> list[str]:
+    args = [DNSMASQ]
     args.append(f"--address=/#/{DEFAULT_GATEWAY}")
-    args.append(f"--dhcp-range={DEFAULT_DHCP_RANGE}")
+    args.append(f"--local-ttl={LOCAL_TTL}")
+    args.append(f"--cache-size={CACHE_SIZE}")
+    args.append(f"--dhcp-range={DEFAULT_DHCP_RANGE},{LEASE_TIME}")
+    args.append(f"--dhcp-lease-max={MAX_LEASES}")
+    args.append(f"--dhcp-leasefile={LEASE_FILE}")
     args.append(f"--dhcp-option=option:router,{DEFAULT_GATEWAY}")
-    args.append(f"--interface={DEFAULT_INTERFACE}")
+    args.append(f"--interface={interface}")
     args.append(f"--keep-in-foreground")
     args.append(f"--bind-interfaces")
     args.append(f"--except-interface=lo")
     args.append(f"--conf-file")
     args.append(f"--no-hosts" )
+    return args
+
+
+#------------------------------------------------------------------------------
+class DnsmasqSupervisor:
+
+    def __init__(self, pid_file: str = PID_FILE):
+        self.pid_file = pid_file
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._ps = None
+        self._thread = None
+        self._started = 0.0 # time.monotonic() of the last start
+        self.interface = None
+        self.state = STOPPED
+        self.restarts = 0
+        self.exit_code = None # of the last crash
+
+    #--------------------------------------------------------------------------
+    # Start dnsmasq on interface and supervise it.  Returns True once it is
+    # answering DNS and DHCP, False if it is not within START_TIMEOUT (it is
+    # still supervised, and restarted if it died).
+    def start(self, interface: str | None = None) -> bool:
+        self.stop()
+        stop_stale(self.pid_file)
+
+        self.interface = interface or DEFAULT_INTERFACE
+        with self._lock:
+            self.restarts = 0
+            self.exit_code = None
+        self._stopping.clear()
+        ps = self._spawn()
+        self._thread = threading.Thread(target=self._watch, args=(ps,),
+                name='dnsmasq', daemon=True)
+        self._thread.start()
+        return self.state == RUNNING
+
+    #--------------------------------------------------------------------------
+    # SIGTERM, and SIGKILL if it has not exited after timeout seconds.
+    def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        self._stopping.set() # no more restarts
+        with self._lock:
+            ps, self._ps = self._ps, None
+        if ps is not None and ps.poll() is None:
+            logger.info(f'Stopping dnsmasq, PID={ps.pid}')
+            ps.terminate()
+            try:
+                ps.wait(timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning(f'dnsmasq, PID={ps.pid}, ignored SIGTERM for {timeout}s, killing it')
+                ps.kill()
+                ps.wait()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if ps is not None:
+            remove_pid_file(self.pid_file)
+        self._set_state(STOPPED)
+
+    #--------------------------------------------------------------------------
+    # What the HTTP server reports.
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {'state': self.state,
+                    'interface': self.interface,
+                    'pid': self._ps.pid if self._ps is not None
+                            and self._ps.poll() is None else None,
+                    'uptime': round(time.monotonic() - self._started, 1)
+                            if self.state == RUNNING else 0,
+                    'restarts': self.restarts,
+                    'exit_code': self.exit_code}
+
+    #--------------------------------------------------------------------------
+    def _set_state(self, state: str) -> None:
+        with self._lock:
+            self.state = state
+
+    # Run dnsmasq and wait until it listens.  Returns the process, or None if
+    # we are stopping.
+    def _spawn(self) -> subprocess.Popen | None:
+        with self._lock:
+            if self._stopping.is_set():
+                return None
+            self.state = STARTING
+            self._ps = ps = subprocess.Popen(build_args(self.interface))
+            self._started = time.monotonic()
+        write_pid_file(self.pid_file, ps.pid)
+
+        if wait_until_listening(ps, START_TIMEOUT):
+            with self._lock:
+                if self._ps is ps:
+                    self.state = RUNNING
+            logger.info(f'Started dnsmasq on {self.interface}, PID={ps.pid}, listening after {time.monotonic() - self._started:.2f}s')
+        elif ps.poll() is None:
+            logger.error(f'dnsmasq, PID={ps.pid}, not listening after {START_TIMEOUT}s')
+        return ps
+
+    # Restart dnsmasq whenever it exits, until stop().
+    def _watch(self, ps: subprocess.Popen | None) -> None:
+        delay = RESTART_DELAY
+        while ps is not None:
+            code = ps.wait()
+            if self._stopping.is_set():
+                return
+            if time.monotonic() - self._started >= STABLE_TIME:
+                delay = RESTART_DELAY
+            with self._lock:
+                self.state = RESTARTING
+                self.exit_code = code
+            logger.error(f'dnsmasq, PID={ps.pid}, exited with {code}, restarting in {delay}s')
+            if self._stopping.wait(delay):
+                return
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+            with self._lock:
+                self.restarts += 1
+            ps = self._spawn()
+
+
+#------------------------------------------------------------------------------
+# The PID file lets a new run stop the dnsmasq a crashed run left behind,
+# without touching any other dnsmasq.
+def write_pid_file(pid_file: str, pid: int) -> None:
+    try:
+        with open(pid_file, 'w') as f:
+            f.write(f'{pid}\n')
+    except OSError as e:
+        logger.debug(f'Could not write {pid_file}: {e}')
+
+
+def remove_pid_file(pid_file: str) -> None:
+    try:
+        os.remove(pid_file)
+    except OSError:
+        pass
+
+
+# SIGTERM the dnsmasq in pid_file, if it is still running.
+def stop_stale(pid_file: str, timeout: float = STOP_TIMEOUT) -> None:
+    try:
+        with open(pid_file) as f:
+            pid = int(f.read().strip())
+        with open(f'/proc/{pid}/comm') as f:
+            if f.read().strip() != 'dnsmasq':
+                return # the PID has been reused
+    except (OSError, ValueError):
+        return
+    finally:
+        remove_pid_file(pid_file)
+
+    logger.info(f'Stopping dnsmasq left over from a previous run, PID={pid}')
+    try:
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            os.kill(pid, 0) # raises once it is gone
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    except OSError as e:
+        logger.warning(f'Could not stop dnsmasq, PID={pid}: {e}')
+
+
+#------------------------------------------------------------------------------
+# The dnsmasq of the whole process, or the built-in responder that takes its
+# place.  Both have the same start(), stop() and to_dict().
+if BUILTIN_RESPONDER:
+    _supervisor = CaptiveResponder(DEFAULT_GATEWAY, DEFAULT_DHCP_RANGE,
+            ttl=LOCAL_TTL, lease_time=LEASE_TIME, max_leases=MAX_LEASES)
+else:
+    _supervisor = DnsmasqSupervisor()
+
+
+# interface is the one the hotspot runs on, from the device_registry.
+def start(interface=None) -> bool:
+    if BUILTIN_RESPONDER:
+        # It needs the ports a dnsmasq of ours may still hold.
+        stop_stale(PID_FILE)
+        interface = interface or DEFAULT_INTERFACE
+    return _supervisor.start(interface)
+
+
+def stop() -> None:
+    _supervisor.stop()
+
+
+def state() -> dict:
+    return _supervisor.to_dict()
+
+
+#------------------------------------------------------------------------------
+# Return the inodes of the sockets a process has open, as in /proc/net/*.
+def socket_inodes(pid: int) -> set[str]:
+    inodes = set()
+    try:
+        fds = os.listdir(f'/proc/{pid}/fd')
+    except OSError as e:
+        logger.debug(f'Could not list the files of {pid}: {e}')
+        return inodes
+    for fd in fds:
+        try:
+            target = os.readlink(f'/proc/{pid}/fd/{fd}')
+        except OSError:
+            continue # closed while we looked
+        if target.startswith('socket:['):
+            inodes.add(target[len('socket:['):-1])
+    return inodes
+
 
-    # run dnsmasq in the background and save a reference to the object
-    ps = subprocess.Popen(args)
-    # don't wait here, proc runs in background until we kill it.
+#------------------------------------------------------------------------------
+# Return the (address, port) of the ipv4 sockets bound in a /proc/net table
+# (for tcp, only listening sockets) whose inode is one of inodes.
+def bound_sockets(table: str, inodes: set[str]) -> set[tuple[str, int]]:
+    sockets = set()
+    try:
+        with open(f'/proc/net/{table}') as f:
+            next(f) # header
+            for line in f:
+                fields = line.split()
+                if table == 'tcp' and fields[3] != TCP_LISTEN:
+                    continue
+                if fields[9] not in inodes:
+                    continue
+                address, port = fields[1].split(':')
+                address = socket.inet_ntoa(bytes.fromhex(address)[::-1])
+                sockets.add((address, int(port, 16)))
+    except (OSError, IndexError, ValueError) as e:
+        logger.debug(f'Could not read /proc/net/{table}: {e}')
+    return sockets
 
-    # give a few seconds for the proc to start
-    time.sleep(2)
-    logger.info(f'Started dnsmasq, PID={ps.pid}')
 
-if __name__ == "__main__":
-    stop()
+#------------------------------------------------------------------------------
+# Wait until our dnsmasq has bound its DNS (udp and tcp 53, on the gateway
+# address) and DHCP (udp 67) sockets.  Only the sockets of ps count, the
+# system's dnsmasq or systemd-resolved may hold port 53 too.  Returns False
+# if the process exits or timeout seconds pass first.
+def wait_until_listening(ps, timeout: float = START_TIMEOUT) -> bool:
+    dns = {(DEFAULT_GATEWAY, DNS_PORT), ('0.0.0.0', DNS_PORT)}
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if ps.poll() is not None:
+            logger.error(f'dnsmasq exited with {ps.returncode}')
+            return False
+        inodes = socket_inodes(ps.pid)
+        udp = bound_sockets('udp', inodes)
+        if udp & dns and any(port == DHCP_PORT for _, port in udp) \
+                and bound_sockets('tcp', inodes) & dns:
+            return True
+        time.sleep(POLL_INTERVAL)
+    return False
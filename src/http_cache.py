@@ -0,0 +1,117 @@
+# Pre-encoded HTTP response bodies.
+#
+# A payload is serialized (and compressed) once, when its content changes,
+# and then written as-is for every request, with an ETag so clients that
+# already have it get a 304.
+#
+# Brotli variants are made when the optional brotli module is installed.
+
+import gzip, hashlib, threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE = 256 # bytes, smaller bodies are not worth compressing
+
+
+#------------------------------------------------------------------------------
+# Return True if the Accept-Encoding header value allows encoding.  The
+# coding's own q-value decides if it is listed, '*' only covers codings that
+# are not (so 'gzip;q=0, *' refuses gzip).
+def accepts_encoding(accept_encoding: str | None, encoding: str) -> bool:
+    if not accept_encoding:
+        return False
+    qvalues = {}
+    for item in accept_encoding.split(','):
+        name, *params = item.split(';')
+        qvalues.setdefault(name.strip().lower(), quality(params))
+    q = qvalues.get(encoding, qvalues.get('*', 0))
+    return q > 0
+
+
+# The q-value in the parameters of one Accept-Encoding item, 1 if it has
+# none, 0 if it is malformed.
+def quality(params: list[str]) -> float:
+    for param in params:
+        key, _, value = param.strip().partition('=')
+        if key.strip().lower() == 'q':
+            try:
+                return float(value.strip())
+            except ValueError:
+                return 0
+    return 1
+
+
+#------------------------------------------------------------------------------
+# Return True if the If-None-Match header value matches one of etags.
+def etag_matches(if_none_match: str | None, *etags: str) -> bool:
+    if not if_none_match:
+        return False
+    for item in if_none_match.split(','):
+        item = item.strip()
+        if item == '*':
+            return True
+        if item.startswith('W/'):
+            item = item[2:]
+        if item in etags:
+            return True
+    return False
+
+
+#------------------------------------------------------------------------------
+# One response body and its compressed variants.
+class EncodedPayload:
+    __slots__ = ('content_type', 'body', 'etag', 'gzip_body', 'gzip_etag',
+            'br_body', 'br_etag')
+
+    def __init__(self, body: bytes, content_type: str, compress: bool = True,
+            use_brotli: bool = False):
+        self.content_type = content_type
+        self.body = body
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        self.etag = f'"{digest}"'
+        self.gzip_body = self.gzip_etag = None
+        self.br_body = self.br_etag = None
+        if compress and len(body) >= MIN_COMPRESS_SIZE:
+            compressed = gzip.compress(body, mtime=0)
+            if len(compressed) < len(body):
+                self.gzip_body = compressed
+                self.gzip_etag = f'"{digest}-gzip"'
+            if use_brotli and brotli is not None:
+                compressed = brotli.compress(body)
+                if len(compressed) < len(body):
+                    self.br_body = compressed
+                    self.br_etag = f'"{digest}-br"'
+
+    # Return (body, content encoding or None, etag) for a request.
+    def select(self, accept_encoding: str | None) -> tuple[bytes, str | None, str]:
+        if self.br_body is not None and accepts_encoding(accept_encoding, 'br'):
+            return self.br_body, 'br', self.br_etag
+        if self.gzip_body is not None and accepts_encoding(accept_encoding, 'gzip'):
+            return self.gzip_body, 'gzip', self.gzip_etag
+        return self.body, None, self.etag
+
+    def not_modified(self, if_none_match: str | None) -> bool:
+        return etag_matches(if_none_match, self.etag, self.gzip_etag,
+                self.br_etag)
+
+
+#------------------------------------------------------------------------------
+# Holds the payload built from a versioned source, and only rebuilds it when
+# the version changes.
+class PayloadMemo:
+
+    def __init__(self, build):
+        self._build = build
+        self._lock = threading.Lock()
+        self._version = None
+        self._payload = None
+
+    def get(self, version, source) -> EncodedPayload:
+        with self._lock:
+            if self._payload is None or version != self._version:
+                self._payload = self._build(source)
+                self._version = version
+            return self._payload
@@ -1,12 +1,11 @@
 # Our main wifi-connect application, which is based around an HTTP server.
 
-import os, getopt, sys, json, atexit
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import os, getopt, sys, json, atexit, threading, time
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 from urllib.parse import parse_qs
-from io import BytesIO
 import logging
 from logging_journald import JournaldLogHandler, check_journal_stream
-from utility import get_config
+from utility import PhaseTimer, get_config
 
 CONFIG = get_config()
 
@@ -29,11 +28,34 @@ if DEBUG:
 # Local modules
 import netman
 import dnsmasq
+from ssid_cache import SSIDCache
+from http_cache import EncodedPayload, PayloadMemo
+from static_assets import StaticAssets
+from captive_probes import CaptiveProbes
+from credentials import check_credentials, lookup_security, hidden_security
+from connectivity_monitor import ConnectivityMonitor
+from connection_profiles import (CONN_TYPE_SEC_NONE, CONN_TYPE_SEC_PASSWORD,
+        CONN_TYPE_SEC_WEP, CONN_TYPE_SEC_ENTERPRISE, CONN_TYPE_SEC_SAE,
+        CONN_TYPE_SEC_OWE)
+from connect_jobs import (ConnectJobs, STEP_STOPPING_HOTSPOT, STEP_CONNECTING,
+        STEP_RESTARTING_HOTSPOT)
 
 # Defaults
 ADDRESS = '192.168.42.1'
 PORT = 80
 UI_PATH = '../ui'
+STATUS_PATH = '/connect/status/'
+PROBES_PATH = '/probes'
+DNSMASQ_PATH = '/dnsmasq'
+MAX_WORKERS = CONFIG.get('HTTP_MAX_WORKERS', 16) # requests we serve at once
+READ_TIMEOUT = CONFIG.get('HTTP_READ_TIMEOUT', 10) # seconds a client may stall within a request
+KEEPALIVE_TIMEOUT = CONFIG.get('HTTP_KEEPALIVE_TIMEOUT', 2) # seconds an idle keep-alive connection is kept
+STATIC_MAX_SIZE = CONFIG.get('STATIC_MAX_SIZE', 1024 * 1024) # bytes, larger UI files are sent from disk
+STATIC_MAX_AGE = CONFIG.get('STATIC_MAX_AGE', 3600) # seconds browsers may cache UI files
+SUPERVISE = CONFIG.get('SUPERVISE') == 'True' # keep running, see supervise_portal()
+OFFLINE_GRACE = CONFIG.get('OFFLINE_GRACE', 30) # seconds offline before the portal comes back
+HOTSPOT_RETRY_INTERVAL = CONFIG.get('HOTSPOT_RETRY_INTERVAL', 300) # seconds, one radio: how often the portal steps aside, 0 never
+HOTSPOT_RETRY_WINDOW = CONFIG.get('HOTSPOT_RETRY_WINDOW', 30) # seconds the hotspot stays down each time
 
 
 #------------------------------------------------------------------------------
@@ -47,33 +69,182 @@ def cleanup():
 #------------------------------------------------------------------------------
 # A custom http server class in which we can set the default path it serves
 # when it gets a GET request.
-class MyHTTPServer(HTTPServer):
-    def __init__(self, base_path, server_address, RequestHandlerClass):
+# Each connection is handled on its own thread, so one slow client (or a
+# burst of captive portal probes from several phones) does not hold up the
+# others.  At most max_workers requests are served at once, further ones wait
+# for a worker.  A keep-alive connection waiting for its next request holds
+# no worker, see MyHTTPReqHandler.handle_one_request().
+class MyHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+    def __init__(self, base_path, server_address, RequestHandlerClass,
+            max_workers=MAX_WORKERS):
         self.base_path = base_path
-        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        self.workers = threading.BoundedSemaphore(max_workers)
+        ThreadingHTTPServer.__init__(self, server_address, RequestHandlerClass)
 
+    # True if no worker is free right now.
+    def busy(self) -> bool:
+        if self.workers.acquire(blocking=False):
+            self.workers.release()
+            return False
+        return True
 
+    # Handlers run on worker threads, where sys.exit() only ends the thread.
+    # Stop serve_forever() in the main thread instead, main() exits from there.
+    def request_exit(self):
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+
+#------------------------------------------------------------------------------
+# check values for byte array and change to string
+def de_byte_values(object_array):
+    output_array = []
+    for object in object_array:
+        result = {}
+        for key, value in object.items():
+            result[key] = value.decode() if isinstance(value, bytes) else value
+        output_array.append(result)
+    return output_array
+
+
+#------------------------------------------------------------------------------
+# Serialize the list of SSIDs for GET /networks.
+def build_networks_payload(ssids):
+    """ map whatever we get from net man to our constants:
+    Security:
+        NONE
+        HIDDEN
+        WEP
+        WPA
+        WPA2
+        WPA3
+        OWE
+        ENTERPRISE
+    Required user input (from UI form), see ap_security.REQUIRED_INPUT:
+        NONE, OWE                    - No input requried.
+        HIDDEN, WEP, WPA, WPA2, WPA3 - Need password.
+        ENTERPRISE                   - Need username and password.
+    Each entry also has the strength (percent), bssid and frequency of the
+    strongest BSSID, the bands ('2.4', '5', '6') and the number of BSSIDs,
+    see access_points.aggregate_by_ssid().  The list is strongest first.
+    """
+    body = json.dumps(de_byte_values(ssids)).encode('utf-8')
+    return EncodedPayload(body, 'application/json')
+
+
+#------------------------------------------------------------------------------
+# Run one connection attempt for a ConnectJob, on the job worker thread.
+# Returns True if we are connected.
+def run_connect_job(job, httpd, ssid_cache, conn_type, ssid, username, password):
+    timer = PhaseTimer(f'Connect job {job.id}')
+
+    # With two radios the hotspot stays up while we try the user's AP, so the
+    # user stays on the portal if it fails.
+    dual_radio = netman.is_dual_radio()
+
+    # Stop the hotspot
+    if not dual_radio:
+        job.set_step(STEP_STOPPING_HOTSPOT)
+        with timer.phase('stop hotspot'):
+            netman.stop_hotspot()
+
+    # Connect to the user's selected AP
+    job.set_step(STEP_CONNECTING)
+    with timer.phase('connect'):
+        success = netman.connect_to_AP(conn_type=conn_type, ssid=ssid, \
+                username=username, password=password,
+                on_state=job.device_state_changed)
+
+    # Handle success or failure of the new connection
+    if success:
+        logger.info(timer.report())
+        logger.info(f'Connected!  Exiting app.')
+        httpd.request_exit()
+        return True
+
+    if dual_radio:
+        logger.warning(f'Connection failed, the hotspot is still up.')
+        with timer.phase('scan'):
+            ssid_cache.refresh()
+        logger.info(timer.report())
+        return False
+
+    logger.warning(f'Connection failed, restarting the hotspot.')
+    job.set_step(STEP_RESTARTING_HOTSPOT)
+
+    # Update the list of SSIDs since we are not connected
+    with timer.phase('scan'):
+        ssid_cache.refresh()
+
+    # Start the hotspot again
+    with timer.phase('start hotspot'):
+        netman.start_hotspot()
+    logger.info(timer.report())
+    return False
 
 
 #------------------------------------------------------------------------------
 # A custom http request handler class factory.
 # Handle the GET and POST requests from the UI form and JS.
 # The class factory allows us to pass custom arguments to the handler.
-def RequestHandlerClassFactory(address, ssids):
+def RequestHandlerClassFactory(address, ssid_cache, connect_jobs, static_assets):
+
+    # The /networks body, rebuilt only when the SSID list changes.
+    networks_payload = PayloadMemo(build_networks_payload)
+
+    # Connectivity checks from the clients on the hotspot.
+    captive_probes = CaptiveProbes()
+    portal_url = f'http://{address}/'
 
     class MyHTTPReqHandler(SimpleHTTPRequestHandler):
 
+        # Keep connections open between requests, but drop ones that stall.
+        protocol_version = 'HTTP/1.1'
+        timeout = READ_TIMEOUT
+        requests_served = 0
+
         def __init__(self, *args, **kwargs):
             # We must set our custom class properties first, since __init__() of
             # our super class will call do_GET().
             self.address = address
-            self.ssids = ssids
+            self.ssid_cache = ssid_cache
+            self.connect_jobs = connect_jobs
+            self.static_assets = static_assets
             try:
                 super(MyHTTPReqHandler, self).__init__(*args, **kwargs)
             except ConnectionResetError as e:
                 logger.error("Connection reset")
 
 
+        # Take a worker only once a request has started to arrive.  Between
+        # requests a keep-alive connection waits KEEPALIVE_TIMEOUT, and is
+        # closed after a request while every worker is busy.
+        def handle_one_request(self):
+            if self.requests_served:
+                self.connection.settimeout(KEEPALIVE_TIMEOUT)
+                try:
+                    if not self.rfile.peek(1):
+                        self.close_connection = True # closed by the client
+                        return
+                except (TimeoutError, ConnectionError):
+                    self.close_connection = True
+                    return
+                self.connection.settimeout(READ_TIMEOUT)
+
+            with self.server.workers:
+                super().handle_one_request()
+            self.requests_served += 1
+            if self.server.busy():
+                self.close_connection = True
+
+        # Tell the client how long we keep the connection open.
+        def end_headers(self):
+            if not self.close_connection:
+                self.send_header('Keep-Alive', f'timeout={KEEPALIVE_TIMEOUT}')
+            super().end_headers()
+
         #suppress sever messages
         def log_message(self, format, *args):
             if not DEBUG:
@@ -81,17 +252,81 @@ def RequestHandlerClassFactory(address, ssids):
             else:
                 super().log_message(format, *args)
 
-        def de_byte_values(self, object_array):
-            """
-            check values for byte array and change to string
-            """
-            output_array = []
-            for object in object_array:
-                result = {}
-                for key, value in object.items():
-                    result[key] = value.decode() if isinstance(value, bytes) else value
-                output_array.append(result)
-            return output_array
+        # Write a pre-encoded payload, or a 304 if the client already has it.
+        def send_payload(self, payload):
+            body, encoding, etag = payload.select(self.headers.get('Accept-Encoding'))
+            if payload.not_modified(self.headers.get('If-None-Match')):
+                # A 304 carries the caching headers the 200 would.
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', payload.content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Vary', 'Accept-Encoding')
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        # Write a file from the UI directory, or a 304 if the client already
+        # has it.
+        def send_asset(self, asset, head_only=False):
+            if asset.payload is not None:
+                body, encoding, etag = asset.payload.select(
+                        self.headers.get('Accept-Encoding'))
+                length = len(body)
+            else:
+                body, encoding, etag = None, None, asset.etag
+                length = asset.size
+
+            if asset.not_modified(self.headers.get('If-None-Match'),
+                    self.headers.get('If-Modified-Since')):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', asset.cache_control)
+                self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', asset.content_type)
+            self.send_header('Content-Length', str(length))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', asset.last_modified)
+            self.send_header('Cache-Control', asset.cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.end_headers()
+            if head_only:
+                return
+
+            if body is not None:
+                self.wfile.write(body)
+                return
+            # Too big to keep in memory, let the kernel copy it.
+            with open(asset.file_path, 'rb') as f:
+                self.connection.sendfile(f, 0, asset.size)
+
+
+        # Write a small JSON response that must not be cached.
+        def send_json(self, status, obj, headers={}):
+            body = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
 
 
         # See if this is a specific request, otherwise let the server handle it.
@@ -101,63 +336,75 @@ def RequestHandlerClassFactory(address, ssids):
 
             # Handle the hotspot starting and a computer connecting to it,
             # we have to return a redirect to the gateway to get the 
-            # captured portal to show up.
-            if '/hotspot-detect.html' == self.path:
-                self.send_response(301) # redirect
-                new_path = f'http://{self.address}/'
-                logger.debug(f'redirecting to {new_path}')
-                self.send_header('Location', new_path)
+            # captured portal to show up.  A 302, clients must not remember
+            # it once they are online.
+            if probe := captive_probes.match(self.headers.get('Host'), self.path):
+                logger.debug(f'{probe} probe {self.path}, redirecting to {portal_url}')
+                self.send_response(302)
+                self.send_header('Location', portal_url)
+                self.send_header('Content-Length', '0')
+                self.send_header('Cache-Control', 'no-store')
                 self.end_headers()
+                return
 
-            if '/generate_204' == self.path:
-                self.send_response(301) # redirect
-                new_path = f'http://{self.address}/'
-                logger.debug(f'redirecting to {new_path}')
-                self.send_header('Location', new_path)
-                self.end_headers()
+            # Which clients are probing, and how often.
+            if PROBES_PATH == self.path:
+                self.send_json(200, captive_probes.hits())
+                return
+
+            # Is dnsmasq up, and how often has it been restarted.
+            if DNSMASQ_PATH == self.path:
+                self.send_json(200, dnsmasq.state())
+                return
 
             # Handle a REST API request to return the list of SSIDs
             if '/networks' == self.path:
-                self.send_response(200)
-                self.end_headers()
-                response = BytesIO()
-                ssids = self.ssids # passed in to the class factory
-                """ map whatever we get from net man to our constants:
-                Security:
-                    NONE         
-                    HIDDEN         
-                    WEP         
-                    WPA        
-                    WPA2      
-                    ENTERPRISE
-                Required user input (from UI form):
-                    NONE                   - No input requried.
-                    HIDDEN, WEP, WPA, WPA2 - Need password.
-                    ENTERPRISE             - Need username and password.
-                """
-                ssids = self.de_byte_values(ssids)
-                response.write(json.dumps(ssids).encode('utf-8'))
-                logger.debug(f'GET {self.path} returning: {response.getvalue()}')
-                self.wfile.write(response.getvalue())
+                ssids, generation = self.ssid_cache.get() # passed in to the class factory
+                payload = networks_payload.get(generation, ssids)
+                logger.debug(f'GET {self.path} returning generation {generation}: {payload.body}')
+                self.send_payload(payload)
+                return
+
+            # Progress of a connection attempt started by a POST.
+            if self.path.startswith(STATUS_PATH):
+                job = self.connect_jobs.get(self.path[len(STATUS_PATH):])
+                if job is None:
+                    self.send_json(404, {'error': 'unknown job'})
+                else:
+                    self.send_json(200, job.to_dict())
                 return
 
             # Not sure if this is just OSX hitting the captured portal,
             # but we need to exit if we get it.
             if '/bag' == self.path:
-                sys.exit()
+                self.send_response(204)
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.server.request_exit()
+                return
+
+            # Files from the ui_path, from memory.
+            if asset := self.static_assets.get(self.path):
+                self.send_asset(asset)
+                return
 
             # All other requests are handled by the server which vends files 
             # from the ui_path we were initialized with.
             super().do_GET()
 
 
+        def do_HEAD(self):
+            if asset := self.static_assets.get(self.path):
+                self.send_asset(asset, head_only=True)
+                return
+            super().do_HEAD()
+
+
         # test with: curl localhost:5000 -d "{'name':'value'}"
         def do_POST(self):
             content_length = int(self.headers['Content-Length'])
             body = self.rfile.read(content_length)
-            self.send_response(200)
-            self.end_headers()
-            response = BytesIO()
+
             fields = parse_qs(body.decode('utf-8'))
             logger.debug(f'POST received: {fields}')
 
@@ -169,6 +416,7 @@ def RequestHandlerClassFactory(address, ssids):
 
             if FORM_SSID not in fields:
                 logger.error(f'Error: POST is missing {FORM_SSID} field.')
+                self.send_json(400, {'error': f'missing {FORM_SSID}'})
                 return
 
             ssid = fields[FORM_SSID][0]
@@ -181,105 +429,251 @@ def RequestHandlerClassFactory(address, ssids):
             if FORM_PASSWORD in fields: 
                 password = fields[FORM_PASSWORD][0] 
 
+            # Reject what can not be right now, rather than after a failed
+            # connection attempt.
+            hidden = FORM_HIDDEN_SSID in fields
+            ssids = self.ssid_cache.ssids
+            error = check_credentials(ssids, ssid, username, password, hidden)
+            if error is not None:
+                logger.warning(f'Rejected connection to {ssid}: {error}')
+                self.send_json(400, {'error': error})
+                return
+
             # Look up the ssid in the list we sent, to find out its security
             # type for the new connection we have to make
-            conn_type = netman.CONN_TYPE_SEC_NONE # Open, no auth AP
-
-            if FORM_HIDDEN_SSID in fields: 
-                conn_type = netman.CONN_TYPE_SEC_PASSWORD # Assumption...
-
-            for s in self.ssids:
-                if FORM_SSID in s and ssid == s[FORM_SSID] or ssid.encode() == s[FORM_SSID]:
-                    if s['security'] == "ENTERPRISE":
-                        conn_type = netman.CONN_TYPE_SEC_ENTERPRISE
-                    elif s['security'] == "NONE":
-                        conn_type = netman.CONN_TYPE_SEC_NONE 
-                    else:
-                        # all others need a password
-                        conn_type = netman.CONN_TYPE_SEC_PASSWORD
-                    break
-
-            # Stop the hotspot
-            netman.stop_hotspot()
-
-            # Connect to the user's selected AP
-            success = netman.connect_to_AP(conn_type=conn_type, ssid=ssid, \
+            conn_type = CONN_TYPE_SEC_NONE # Open, no auth AP
+
+            security = hidden_security(password) if hidden \
+                    else lookup_security(ssids, ssid)
+            if security == "WEP":
+                conn_type = CONN_TYPE_SEC_WEP
+            elif security == "ENTERPRISE":
+                conn_type = CONN_TYPE_SEC_ENTERPRISE
+            elif security == "WPA3":
+                conn_type = CONN_TYPE_SEC_SAE
+            elif security == "OWE":
+                conn_type = CONN_TYPE_SEC_OWE
+            elif security is not None and security != "NONE":
+                # all others need a password
+                conn_type = CONN_TYPE_SEC_PASSWORD
+
+            # Connecting takes the hotspot down, so answer first and let the
+            # job do the work.  The UI polls the status until it is done.
+            job, created = self.connect_jobs.create(ssid)
+            if not created:
+                logger.warning('POST while a connection attempt is running.')
+                self.send_json(409, job.to_dict())
+                return
+            status_path = f'{STATUS_PATH}{job.id}'
+            self.send_json(202, job.to_dict(), {'Location': status_path})
+            self.wfile.flush()
+            self.connect_jobs.submit(job, conn_type=conn_type, ssid=ssid,
                     username=username, password=password)
 
-            if success:
-                response.write(b'OK\n')
-            else:
-                response.write(b'ERROR\n')
-            self.wfile.write(response.getvalue())
-
-            # Handle success or failure of the new connection
-            if success:
-                logger.info(f'Connected!  Exiting app.')
-                sys.exit()
-            else:
-                logger.warning(f'Connection failed, restarting the hotspot.')
+    return  MyHTTPReqHandler # the class our factory just created.
 
-                # Update the list of SSIDs since we are not connected
-                self.ssids = netman.get_list_of_access_points()
 
-                # Start the hotspot again
-                netman.start_hotspot() 
+#------------------------------------------------------------------------------
+# Check if we are online, if not run the portal until the user has connected
+# us.  With supervise, keep running instead, see supervise_portal().
+def main(address, port, ui_path, delete_connections, ignore_connections,
+        supervise=False):
 
-    return  MyHTTPReqHandler # the class our factory just created.
+    # Where startup time goes, logged once we are serving.
+    timer = PhaseTimer('Startup')
 
+    # See if caller wants to delete all existing connections first.  Not when
+    # supervising, the profiles we have are the ones we wait for.
+    if delete_connections and not supervise:
+        with timer.phase('delete connections'):
+            netman.delete_all_wifi_connections()
 
-#------------------------------------------------------------------------------
-# Create the hotspot, start dnsmasq, start the HTTP server.
-def main(address, port, ui_path, delete_connections, ignore_connections):
+    # Find the ui directory which is up one from where this file is located.
+    web_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ui_path))
 
-    # See if caller wants to delete all existing connections first
-    if delete_connections:
-        netman.delete_all_wifi_connections()
+    if supervise:
+        supervise_portal(address, port, web_dir, timer, ignore_connections)
+        return
 
     #Check if we are already connected, if so we are done.
-    if not ignore_connections and netman.have_active_internet_connection():
+    with timer.phase('internet check'):
+        connected = not ignore_connections and \
+                netman.have_active_internet_connection()
+    if connected:
         print('Already connected to the internet, nothing to do, exiting.')
-        sys.exit()
+        return
 
+    try:
+        if not run_portal(address, port, web_dir, timer):
+            logger.error('Error starting hotspot, exiting.')
+            sys.exit(1)
+    except KeyboardInterrupt:
+        return
+
+
+#------------------------------------------------------------------------------
+# Run forever: take the portal down as soon as NM reports (and the
+# connectivity checker confirms) that we are online, and bring it back once
+# we have been offline for OFFLINE_GRACE seconds.
+# With one radio NM can not autoconnect to a known network while the hotspot
+# is up, so the portal steps aside every HOTSPOT_RETRY_INTERVAL seconds for
+# HOTSPOT_RETRY_WINDOW seconds, see step_aside_periodically().
+def supervise_portal(address, port, web_dir, timer, ignore_connections):
+    monitor = ConnectivityMonitor(netman.connectivity_checker)
+    with timer.phase('internet check'):
+        monitor.start()
+
+    # -i runs the first portal whatever the connection, and only the user
+    # connecting ends it.
+    portal_needed = ignore_connections or not monitor.online
+    try:
+        while True:
+            if portal_needed:
+                timer = timer or PhaseTimer('Portal restart')
+                stepped_aside = threading.Event()
+                if not run_portal(address, port, web_dir, timer,
+                        None if ignore_connections else monitor, stepped_aside):
+                    logger.error(f'Error starting hotspot, trying again in {OFFLINE_GRACE}s.')
+                    time.sleep(OFFLINE_GRACE)
+                    continue
+                ignore_connections = False
+                timer = None
+
+                # A new connection may need a moment to be seen as online,
+                # a known network a while to autoconnect.
+                if stepped_aside.is_set():
+                    if not monitor.wait_online(HOTSPOT_RETRY_WINDOW):
+                        logger.info(f'No known network came up in {HOTSPOT_RETRY_WINDOW}s, starting the portal again.')
+                        continue
+                elif not monitor.wait_online(OFFLINE_GRACE):
+                    logger.warning(f'Still offline {OFFLINE_GRACE}s after the portal closed.')
+                    continue
+
+            logger.info('Online, watching the connection.')
+            monitor.wait_offline(OFFLINE_GRACE)
+            logger.warning(f'Offline for {OFFLINE_GRACE}s, starting the portal.')
+            portal_needed = True
+    except KeyboardInterrupt:
+        return
+
+
+#------------------------------------------------------------------------------
+# Create the hotspot, start dnsmasq, serve the portal until the user has
+# connected us or, with a monitor, until we are online some other way.  The
+# hotspot and dnsmasq are stopped again before returning.
+# With a monitor and a stepped_aside event, a single radio portal also
+# closes now and then to let NM try the networks it knows, and sets the event
+# when it does.
+# Returns False if the hotspot could not be started.
+def run_portal(address, port, web_dir, timer, monitor=None,
+        stepped_aside=None) -> bool:
     # Get list of available AP from net man.  
-    # Must do this AFTER deleting any existing connections (above),
+    # Must do this AFTER deleting any existing connections (in main()),
     # and BEFORE starting our hotspot (or the hotspot will be the only thing
     # in the list).
-    ssids = netman.get_list_of_access_points()
+    # With two radios, the background refresh scans on the station radio
+    # while the hotspot starts, and the portal serves the networks it has
+    # found so far without waiting for the scan to complete.
+    ssid_cache = SSIDCache(ttl=CONFIG.get('SSID_CACHE_TTL', 60))
+    dual_radio = netman.is_dual_radio()
+    if dual_radio:
+        ssid_cache.start()
+    else:
+        with timer.phase('scan'):
+            ssid_cache.refresh()
 
     # Start the hotspot
-    if not netman.start_hotspot():
-        logger.error('Error starting hotspot, exiting.')
-        sys.exit(1)
+    with timer.phase('start hotspot'):
+        hotspot_started = netman.start_hotspot()
+    if not hotspot_started:
+        ssid_cache.stop()
+        return False
 
     # Start dnsmasq (to advertise us as a router so captured portal pops up
     # on the users machine to vend our UI in our http server)
-    dnsmasq.start()
+    with timer.phase('start dnsmasq'):
+        dnsmasq.start(netman.get_hotspot_interface())
 
-    # Find the ui directory which is up one from where this file is located.
-    web_dir = os.path.join(os.path.dirname(__file__), ui_path)
     logger.info(f'HTTP serving directory: {web_dir} on {address}:{port}')
 
     # Change to this directory so the HTTPServer returns the index.html in it 
     # by default when it gets a GET.
     os.chdir(web_dir)
 
+    # Load the UI files into memory.
+    with timer.phase('load UI files'):
+        static_assets = StaticAssets(web_dir, max_size=STATIC_MAX_SIZE,
+                max_age=STATIC_MAX_AGE,
+                use_brotli=CONFIG.get('USE_BROTLI') == 'True')
+
     # Host:Port our HTTP server listens on
     server_address = (address, port)
 
+    # Keep the list current while we wait, if the radio can scan in AP mode
+    # (with two radios the refresh is already running).
+    if CONFIG.get('BACKGROUND_SCAN') == 'True':
+        ssid_cache.start()
+
+    # Connection attempts run in the background, one at a time.
+    connect_jobs = ConnectJobs(lambda job, **params:
+            run_connect_job(job, httpd, ssid_cache, **params))
+    connect_jobs.start()
+
     # Custom request handler class (so we can pass in our own args)
-    MyRequestHandlerClass = RequestHandlerClassFactory(address, ssids)
+    MyRequestHandlerClass = RequestHandlerClassFactory(address, ssid_cache,
+            connect_jobs, static_assets)
 
     # Start an HTTP server to serve the content in the ui dir and handle the 
     # POST request in the handler class.
     logger.info(f'Waiting for a connection to our hotspot {netman.get_hotspot_SSID()} ...')
     httpd = MyHTTPServer(web_dir, server_address, MyRequestHandlerClass)
+    logger.info(timer.report())
+
+    # Close the portal as soon as we are online, e.g. the router came back.
+    portal_closed = threading.Event()
+    if monitor is not None:
+        threading.Thread(target=exit_when_online,
+                args=(monitor, httpd, portal_closed),
+                name='exit-when-online', daemon=True).start()
+    if monitor is not None and stepped_aside is not None and not dual_radio \
+            and HOTSPOT_RETRY_INTERVAL:
+        threading.Thread(target=step_aside_periodically,
+                args=(httpd, connect_jobs, portal_closed, stepped_aside),
+                name='step-aside', daemon=True).start()
+
     try:
+        # Until a handler, or exit_when_online(), asks us to exit.
         httpd.serve_forever()
-    except KeyboardInterrupt:
+    finally:
+        portal_closed.set()
+        ssid_cache.stop()
+        connect_jobs.stop()
         dnsmasq.stop()
         netman.stop_hotspot()
         httpd.server_close()
+    return True
+
+
+def exit_when_online(monitor, httpd, portal_closed):
+    while not portal_closed.is_set():
+        if monitor.wait_online(timeout=1):
+            logger.info('Online, closing the portal.')
+            httpd.request_exit()
+            return
+
+
+# The hotspot holds the only radio, so NM can not even look for the networks
+# it knows.  Every HOTSPOT_RETRY_INTERVAL seconds, unless the user is
+# connecting us, close the portal and let supervise_portal() give NM
+# HOTSPOT_RETRY_WINDOW seconds before the hotspot comes back.
+def step_aside_periodically(httpd, connect_jobs, portal_closed, stepped_aside):
+    while not portal_closed.wait(HOTSPOT_RETRY_INTERVAL):
+        if connect_jobs.busy():
+            continue
+        logger.info(f'Taking the hotspot down for {HOTSPOT_RETRY_WINDOW}s so known networks can connect.')
+        stepped_aside.set()
+        httpd.request_exit()
+        return
 
 
 #------------------------------------------------------------------------------
@@ -301,6 +695,7 @@ if __name__ == "__main__":
     ui_path = UI_PATH
     delete_connections = True
     ignore_connections = False
+    supervise = SUPERVISE
 
     usage = ''\
 f'Command line args: \n'\
@@ -309,10 +704,11 @@ f'  -p <HTTP server port>        Default: {port} \n'\
 f'  -u <UI directory to serve>   Default: "{ui_path}" \n'\
 f'  -d Delete Connections First  Default: {delete_connections} \n'\
 f'  -i Ignore Connections        Default: {ignore_connections} \n'\
+f'  -s Supervise (keep running)  Default: {supervise} \n'\
 f'  -h Show help.\n'
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "a:p:u:cdh")
+        opts, args = getopt.getopt(sys.argv[1:], "a:p:u:cdhis")
     except getopt.GetoptError:
         logger.error(usage)
         sys.exit(2)
@@ -337,11 +733,16 @@ f'  -h Show help.\n'
         elif opt in {"-i"}:
             ignore_connections = True
 
+        elif opt in {"-s"}:
+            supervise = True
+
     logger.info(f'Address={address}')
     logger.info(f'Port={port}')
     logger.info(f'UI path={ui_path}')
     logger.info(f'Delete Connections={delete_connections}')
     logger.info(f'Ignore Connections={ignore_connections}')
-    main(address, port, ui_path, delete_connections, ignore_connections)
+    logger.info(f'Supervise={supervise}')
+    main(address, port, ui_path, delete_connections, ignore_connections,
+            supervise)
 
 
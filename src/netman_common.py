@@ -0,0 +1,114 @@
+# Settings and helpers shared by the blocking (netman) and asyncio
+# (async_netman) implementations.
+#
+# Nothing here talks to NetworkManager itself: devices are looked up in the
+# device_registry, profiles are built by connection_profiles, and the two
+# implementations make the D-Bus calls their own way.
+
+import logging
+
+from sdbus_block.networkmanager.enums import WirelessCapabilities
+
+from connection_profiles import CONN_TYPE_HOTSPOT, build_connection_dict
+from device_registry import DeviceRecord, get_registry
+from utility import create_state_file, get_config, get_serial
+
+ACTIVATION_TIMEOUT = 30 # seconds to wait for a connection to become active
+DEACTIVATION_TIMEOUT = 10 # seconds to wait for a device to let go of a deleted connection
+
+CONFIG = get_config()
+SCAN_TIMEOUT = CONFIG.get('SCAN_TIMEOUT', 10) # seconds to wait for a scan to complete
+HOTSPOT_IN_MEMORY = CONFIG.get('HOTSPOT_IN_MEMORY', 'True') == 'True' # never write the hotspot profile to disk
+REUSE_HOTSPOT_PROFILE = CONFIG.get('REUSE_HOTSPOT_PROFILE') == 'True' # update the hotspot profile instead of recreating it
+HOTSPOT_BAND = CONFIG.get('HOTSPOT_BAND', 'bg') # 'bg' (2.4GHz) or 'a' (5GHz)
+HOTSPOT_CHANNEL = CONFIG.get('HOTSPOT_CHANNEL', 0) # 0 lets NM pick
+HOTSPOT_INTERFACE = CONFIG.get('HOTSPOT_INTERFACE', '') # '' for the first wifi device
+STATION_INTERFACE = CONFIG.get('STATION_INTERFACE', '') # '' to scan and connect on the hotspot device
+
+# Settings.Connection.Update2() flags
+UPDATE2_FLAG_TO_DISK   = 0x1
+UPDATE2_FLAG_IN_MEMORY = 0x2
+
+logger = logging.getLogger('wifi-connect')
+
+
+#------------------------------------------------------------------------------
+# Get hotspot SSID name.
+def get_hotspot_SSID():
+    return CONFIG['HOTSPOT_BASE'] + get_serial()[-4:]
+
+
+#------------------------------------------------------------------------------
+# The device the hotspot runs on: HOTSPOT_INTERFACE, or the first wifi device.
+# None if there is no such device.
+def get_hotspot_device() -> DeviceRecord | None:
+    return get_registry().wifi_device(HOTSPOT_INTERFACE)
+
+
+# The device we scan and connect to the user's AP on: STATION_INTERFACE, or
+# the hotspot device.
+def get_station_device() -> DeviceRecord | None:
+    if STATION_INTERFACE:
+        return get_registry().wifi_device(STATION_INTERFACE)
+    return get_hotspot_device()
+
+
+# True if the hotspot and the user's connection are on separate radios (or
+# virtual interfaces of one radio), so the hotspot can stay up while we scan
+# and connect.
+def is_dual_radio() -> bool:
+    hotspot, station = get_hotspot_device(), get_station_device()
+    return hotspot is not None and station is not None \
+            and hotspot.path != station.path
+
+
+def get_hotspot_interface() -> str | None:
+    device = get_hotspot_device()
+    return device.interface if device else None
+
+
+#------------------------------------------------------------------------------
+# Where NM keeps a profile we add: the hotspot is recreated on every start, so
+# (with HOTSPOT_IN_MEMORY) it lives in memory only and never touches the SD
+# card.  The user's connection must survive a reboot, but with two radios it
+# starts as a trial: volatile, so NM deletes it if it fails to activate, and
+# only written to disk once it is live.
+def connection_persistence(conn_type) -> str:
+    if conn_type == CONN_TYPE_HOTSPOT and HOTSPOT_IN_MEMORY:
+        return 'memory'
+    if conn_type != CONN_TYPE_HOTSPOT and is_dual_radio():
+        return 'volatile'
+    return 'disk'
+
+
+#------------------------------------------------------------------------------
+# The first half of connect_to_AP(): pick the device for conn_type and build
+# the profile for it, bound to that device.
+# Returns (device, settings dict, display string), or None after logging why.
+def prepare_connection(conn_type, conn_name, ssid, username=None, password=None):
+    device = get_hotspot_device() if conn_type == CONN_TYPE_HOTSPOT \
+            else get_station_device()
+    if device is None:
+        logger.error(f"connect_to_AP() Error: No suitable and available 802-11-wireless device found.")
+        return None
+    if conn_type == CONN_TYPE_HOTSPOT and \
+            not device.wireless_capabilities & WirelessCapabilities.AP:
+        logger.warning(f'{device.interface} does not report AP mode support')
+
+    conn_dict, conn_str = build_connection_dict(conn_type, conn_name, ssid,
+            username, password, band=HOTSPOT_BAND, channel=HOTSPOT_CHANNEL,
+            interface=device.interface)
+    if conn_dict is None:
+        logger.error(f'connect_to_AP() Error: Invalid conn_type="{conn_type}"')
+        return None
+    return device, conn_dict, conn_str
+
+
+#------------------------------------------------------------------------------
+# Leave the flag file for the kind of connection that just came up.
+def mark_connected(conn_str: str) -> None:
+    file_type = 'hotspot' if conn_str == 'HOTSPOT' else 'client'
+    if create_state_file(file_type):
+        logger.info(f'{file_type} flag file create')
+    else:
+        logger.error(f'Could not create {file_type} flag file')
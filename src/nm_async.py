@@ -0,0 +1,17 @@
+# The sdbus_async.networkmanager proxies, importable next to
+# sdbus_block.networkmanager.
+#
+# Both packages register the same NetworkManager D-Bus error names with sdbus
+# in their exceptions module, and sdbus refuses to map a name twice, so
+# whichever is imported second raises ValueError.  The two exceptions modules
+# are identical; load the async package with the blocking one's.  Import the
+# async proxies from here, never from sdbus_async.networkmanager directly.
+
+import sys
+
+import sdbus_block.networkmanager.exceptions
+
+sys.modules.setdefault('sdbus_async.networkmanager.exceptions',
+        sdbus_block.networkmanager.exceptions)
+
+from sdbus_async.networkmanager import * # noqa: E402,F401,F403
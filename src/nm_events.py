@@ -0,0 +1,181 @@
+# Wait for NetworkManager state changes using D-Bus signals instead of
+# polling properties in a sleep loop.
+#
+# The sdbus_block proxies used by netman can not receive signals, so the waits
+# here are coroutines on sdbus_async proxies.  Code that is not running an
+# event loop calls them through run_on_private_bus(), which opens a new system
+# bus connection for the lifetime of a single asyncio.run().  Every coroutine
+# takes the bus as an argument, so it can be pointed at a private dbus-daemon
+# running a fake NetworkManager service.
+
+import asyncio, time
+import logging
+from dataclasses import dataclass
+
+import sdbus
+from nm_async import (
+    ActiveConnection,
+    NetworkDeviceGeneric,
+)
+from sdbus_async.networkmanager.enums import (
+    ConnectionState,
+    ConnectionStateReason,
+    DeviceState,
+    DeviceStateReason,
+)
+
+logger = logging.getLogger('wifi-connect')
+
+
+#------------------------------------------------------------------------------
+# Convert a raw D-Bus value to an enum member, NM may send values newer than
+# the enums we know about.
+def to_enum(enum, value: int):
+    try:
+        return enum(value)
+    except ValueError:
+        return value
+
+
+#------------------------------------------------------------------------------
+# Outcome of waiting for a device to activate.
+@dataclass
+class ActivationResult:
+    activated: bool
+    state: DeviceState | ConnectionState | int
+    reason: DeviceStateReason | ConnectionStateReason | int
+    elapsed: float
+
+    def describe(self) -> str:
+        state = getattr(self.state, 'name', self.state)
+        reason = getattr(self.reason, 'name', self.reason)
+        return f'state={state} reason={reason} after {self.elapsed:.2f}s'
+
+
+#------------------------------------------------------------------------------
+# Run one of the coroutines below from blocking code on its own bus
+# connection.  sdbus attaches a bus to the first event loop that uses it, so a
+# bus can not be shared between separate asyncio.run() calls.
+def run_on_private_bus(coroutine_function, *args, **kwargs):
+    bus = sdbus.sd_bus_open_system()
+    try:
+        return asyncio.run(coroutine_function(*args, bus=bus, **kwargs))
+    finally:
+        bus.close()
+
+
+#------------------------------------------------------------------------------
+# Wait for a device to reach ACTIVATED or FAILED.
+# Listens to the device StateChanged signal and, if given, the StateChanged
+# signal of the active connection returned by ActivateConnection.  Returns as
+# soon as either reaches a final state, or when timeout seconds have passed.
+# on_state(state, reason) is called for every device state we see.
+async def wait_for_activation(device_path: str, active_path: str = '/',
+        timeout: float = 30, on_state=None, bus=None) -> ActivationResult:
+    start = time.monotonic()
+    device = NetworkDeviceGeneric(device_path, bus)
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def watch_device():
+        async for new_state, old_state, reason in device.state_changed:
+            events.put_nowait((DeviceState, new_state, reason))
+
+    async def watch_active_connection():
+        active = ActiveConnection(active_path, bus)
+        async for state, reason in active.state_changed:
+            events.put_nowait((ConnectionState, state, reason))
+
+    watchers = [asyncio.create_task(watch_device())]
+    if active_path and active_path != '/':
+        watchers.append(asyncio.create_task(watch_active_connection()))
+
+    try:
+        # Let the watchers send their AddMatch calls before we read the current
+        # state.  The bus daemon handles the messages of one connection in
+        # order, so no transition after this read can be missed.
+        await asyncio.sleep(0)
+        state, reason = await device.state_reason
+        current_connection = await device.active_connection
+
+        # The device may still show ACTIVATED for the connection we replaced,
+        # only trust it if it is the connection we are waiting for.
+        if state == DeviceState.ACTIVATED and \
+                active_path not in (None, '/', current_connection):
+            state = DeviceState.PREPARE
+        events.put_nowait((DeviceState, state, reason))
+
+        deadline = start + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                source, state, reason = await asyncio.wait_for(events.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+            if source is DeviceState:
+                state = to_enum(DeviceState, state)
+                reason = to_enum(DeviceStateReason, reason)
+                logger.debug(f'dev.state={state!r} reason={reason!r}')
+                if on_state is not None:
+                    on_state(state, reason)
+                if state in (DeviceState.ACTIVATED, DeviceState.FAILED):
+                    return ActivationResult(state == DeviceState.ACTIVATED,
+                            state, reason, time.monotonic() - start)
+            else:
+                state = to_enum(ConnectionState, state)
+                reason = to_enum(ConnectionStateReason, reason)
+                logger.debug(f'active_connection.state={state!r} reason={reason!r}')
+                if state == ConnectionState.DEACTIVATED:
+                    return ActivationResult(False, state, reason,
+                            time.monotonic() - start)
+
+        # Out of time, report the last thing NM told us about the device.
+        state, reason = await device.state_reason
+        current_connection = await device.active_connection
+        activated = state == DeviceState.ACTIVATED and \
+                active_path in (None, '/', current_connection)
+        return ActivationResult(activated, to_enum(DeviceState, state),
+                to_enum(DeviceStateReason, reason), time.monotonic() - start)
+    finally:
+        for watcher in watchers:
+            watcher.cancel()
+        await asyncio.gather(*watchers, return_exceptions=True)
+
+
+#------------------------------------------------------------------------------
+# Wait for devices to leave ACTIVATED (and DEACTIVATING), for example after
+# the profile they were using is deleted.  Returns True if all of them are
+# disconnected within timeout seconds.
+async def wait_for_deactivation(device_paths: list[str], timeout: float = 10,
+        bus=None) -> bool:
+    # Not DISCONNECTED, NM may already be activating another profile.
+    busy = (DeviceState.ACTIVATED, DeviceState.DEACTIVATING)
+
+    async def wait_for_device(device_path):
+        device = NetworkDeviceGeneric(device_path, bus)
+        events: asyncio.Queue = asyncio.Queue()
+
+        async def watch_device():
+            async for new_state, old_state, reason in device.state_changed:
+                events.put_nowait(new_state)
+
+        watcher = asyncio.create_task(watch_device())
+        try:
+            # Subscribe first, see wait_for_activation().
+            await asyncio.sleep(0)
+            state = await device.state
+            while state in busy:
+                state = await events.get()
+            logger.debug(f'{device_path} released, state={to_enum(DeviceState, state)!r}')
+        finally:
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+
+    if not device_paths:
+        return True
+    try:
+        await asyncio.wait_for(asyncio.gather(
+                *(wait_for_device(path) for path in device_paths)), timeout)
+        return True
+    except asyncio.TimeoutError:
+        logger.warning(f'Devices still active after {timeout}s: {device_paths}')
+        return False
@@ -0,0 +1,121 @@
+# Shared cache of the SSIDs we show in the portal.
+#
+# The HTTP handlers read the list without scanning.  It is filled before the
+# hotspot starts, refreshed after a failed connection attempt, and, when the
+# radio can scan while it is an AP (BACKGROUND_SCAN in .env.global) or a
+# second radio does the scanning, refreshed in a background thread whenever it
+# is older than its TTL.
+#
+# While a scan runs, the networks it has found so far are published as they
+# come in (see set_partial()), so a portal opened mid-scan is not left empty.
+
+import threading, time
+import logging
+
+import netman
+
+logger = logging.getLogger('wifi-connect')
+
+
+class SSIDCache:
+
+    def __init__(self, ttl: float = 60, scan=netman.get_list_of_access_points):
+        self.ttl = ttl
+        self._scan = scan
+        self._lock = threading.Lock()
+        self._ssids = []
+        self._updated = 0.0 # time.time() of the last update, 0 for never
+        self._generation = 0 # incremented on every update
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    #--------------------------------------------------------------------------
+    # Return (ssids, generation).  The list is replaced, never modified, on an
+    # update, so callers may keep it without copying.
+    def get(self) -> tuple[list, int]:
+        with self._lock:
+            return self._ssids, self._generation
+
+    @property
+    def ssids(self) -> list:
+        return self.get()[0]
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    @property
+    def updated(self) -> float:
+        with self._lock:
+            return self._updated
+
+    def is_stale(self) -> bool:
+        return time.time() - self.updated > self.ttl
+
+    #--------------------------------------------------------------------------
+    # Replace the list.
+    def set(self, ssids: list) -> None:
+        with self._lock:
+            self._ssids = ssids
+            self._updated = time.time()
+            self._generation += 1
+        logger.debug(f'SSID cache generation {self._generation}: {len(ssids)} SSIDs')
+
+    # Publish the networks a running scan has found so far, if they are more
+    # than the list holds; a refresh never shows fewer networks before it is
+    # complete.  Bumps the generation but not updated, the scan is not done.
+    def set_partial(self, ssids: list) -> None:
+        with self._lock:
+            if len(ssids) <= len(self._ssids):
+                return
+            self._ssids = ssids
+            self._generation += 1
+
+    #--------------------------------------------------------------------------
+    # Scan now, on the calling thread.  An empty result does not replace a
+    # non-empty list, most radios return nothing when asked to scan in AP mode.
+    def refresh(self) -> None:
+        ssids = self._scan(on_partial=self.set_partial)
+        if not ssids and self.ssids:
+            logger.debug('Scan returned no SSIDs, keeping the cached list.')
+            with self._lock:
+                self._updated = time.time()
+            return
+        self.set(ssids)
+
+    #--------------------------------------------------------------------------
+    # Refresh in a background thread every ttl seconds, or sooner if
+    # request_refresh() is called.
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='ssid-cache',
+                daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def request_refresh(self) -> None:
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        netman.init_thread_bus()
+        while not self._stopped.is_set():
+            wait = max(0, self.updated + self.ttl - time.time())
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f'Background scan failed: {e}')
+                self._stopped.wait(self.ttl)
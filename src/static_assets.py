@@ -0,0 +1,111 @@
+# In-memory index of the files under the UI directory.
+#
+# The files are read (and compressed) once at startup, so a request for one
+# is answered from memory with no stat, open or read, and with the headers a
+# browser needs to cache it: ETag, Last-Modified and Cache-Control.  Files
+# larger than max_size are not held in memory, they are sent from disk with
+# socket.sendfile().
+
+import mimetypes, os
+import logging
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote, urlsplit
+
+from http_cache import EncodedPayload, etag_matches
+
+logger = logging.getLogger('wifi-connect')
+
+MAX_SIZE = 1024 * 1024 # bytes, larger files are sent from disk
+MAX_AGE = 3600 # seconds browsers may use a file without asking again
+INDEX_FILE = 'index.html'
+
+
+#------------------------------------------------------------------------------
+# One file.  payload is None for a file sent from disk.
+class StaticAsset:
+    __slots__ = ('file_path', 'size', 'mtime', 'last_modified', 'content_type',
+            'cache_control', 'etag', 'payload')
+
+    def __init__(self, file_path: str, max_size: int, max_age: int,
+            use_brotli: bool):
+        stat = os.stat(file_path)
+        self.file_path = file_path
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.content_type = mimetypes.guess_type(file_path)[0] \
+                or 'application/octet-stream'
+        # The page itself is revalidated every time, so a new release shows
+        # up, what it links to is cached.
+        if self.content_type == 'text/html':
+            self.cache_control = 'no-cache'
+        else:
+            self.cache_control = f'public, max-age={max_age}'
+        self.payload = None
+        if self.size <= max_size:
+            with open(file_path, 'rb') as f:
+                self.payload = EncodedPayload(f.read(), self.content_type,
+                        compress=is_compressible(self.content_type),
+                        use_brotli=use_brotli)
+            self.etag = self.payload.etag
+        else:
+            self.etag = f'"{self.mtime:x}-{self.size:x}"'
+
+    # True if the client's copy, described by its conditional headers, is
+    # current.  If-None-Match wins over If-Modified-Since when both are sent.
+    def not_modified(self, if_none_match: str | None,
+            if_modified_since: str | None) -> bool:
+        if if_none_match:
+            if self.payload is not None:
+                return self.payload.not_modified(if_none_match)
+            return etag_matches(if_none_match, self.etag)
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() \
+                        >= self.mtime
+            except (TypeError, ValueError, OverflowError):
+                return False
+        return False
+
+
+#------------------------------------------------------------------------------
+# Images other than svg are already compressed.
+def is_compressible(content_type: str) -> bool:
+    return content_type.startswith('text/') or content_type in (
+            'application/javascript', 'application/json', 'image/svg+xml',
+            'image/vnd.microsoft.icon', 'image/x-icon')
+
+
+#------------------------------------------------------------------------------
+# The assets under a directory, keyed by URL path.
+class StaticAssets:
+
+    def __init__(self, root: str, max_size: int = MAX_SIZE,
+            max_age: int = MAX_AGE, use_brotli: bool = False):
+        self.root = os.path.abspath(root)
+        self._assets = {}
+        total = 0
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+            for file_name in file_names:
+                if file_name.startswith('.'):
+                    continue
+                file_path = os.path.join(dir_path, file_name)
+                try:
+                    asset = StaticAsset(file_path, max_size, max_age, use_brotli)
+                except OSError as e:
+                    logger.error(f'Could not load {file_path}: {e}')
+                    continue
+                url_path = '/' + os.path.relpath(file_path, self.root).replace(os.sep, '/')
+                self._assets[url_path] = asset
+                if file_name == INDEX_FILE:
+                    # Directory URLs serve their index.html, as the
+                    # SimpleHTTPRequestHandler does.
+                    self._assets[url_path[:-len(INDEX_FILE)]] = asset
+                if asset.payload is not None:
+                    total += len(asset.payload.body)
+        logger.debug(f'Loaded {len(self._assets)} static assets ({total} bytes) from {self.root}')
+
+    # Return the asset for a request path, or None.
+    def get(self, path: str) -> StaticAsset | None:
+        return self._assets.get(unquote(urlsplit(path).path))
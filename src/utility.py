@@ -5,21 +5,21 @@
 #
 
 
-import sdbus
 from sdbus_block.networkmanager import (
     ConnectionType,
-    NetworkConnectionSettings,
-    NetworkManagerSettings,
     NetworkManager,  
     NetworkDeviceGeneric,
     DeviceType,
 )
 
-import os
+import os, time
+from contextlib import contextmanager
 from enum import Enum
 import logging
 from dotenv import dotenv_values
 
+from connection_index import ConnectionRecords, get_index
+
 logger = logging.getLogger('wifi-connect')
 
 
@@ -29,40 +29,21 @@ logger = logging.getLogger('wifi-connect')
 # NetworkManagerAddressData = List[Dict[str, Tuple[str, Any]]]
 
 
-def get_connections(ifname: str, dev_type: str) -> dict[int,tuple[str, str]] | None:
+def get_connections(ifname: str, dev_type: str) -> ConnectionRecords:
     """
     Return all connections used by for this device/interface
 
     It uses getattr(ConnectionType, dev_type) to get the connection_type
     used for connection_profiles for this DeviceType.
 
-    return a dictionary with key of timestamp and value of (name, UUID and its delete function) as a tuple
+    The profiles come from the connection_index, not from NetworkManager.
+
+    return the ConnectionRecords keyed by uuid, most recently activated
+    first, empty (False) for none
 
     """
-    settings_service = NetworkManagerSettings()
-    connection_paths: list[str] = settings_service.connections
-    conns = {}
-    for connection_path in connection_paths:
-        connection_manager = NetworkConnectionSettings(connection_path)
-        connection = connection_manager.get_profile().connection
-        # Filter connection profiles matching the connection type for the device:
-        if connection.connection_type != getattr(ConnectionType, dev_type):
-            continue
-        # If the interface_name of a connection profiles is set, it must match:
-        if connection.interface_name and connection.interface_name != ifname:
-            continue
-        # If connection.timestamp is not set, it was never active. Set it to 0:
-        if not connection.timestamp:
-            connection.timestamp = 0
-        if not connection.uuid:
-            connection.uuid = ""
-       
-        # Record the connection_ids of the matches, and timestamp is the key:
-        conns[connection.timestamp] = (connection.connection_id, connection.uuid,)
-    if not len(conns):
-        return None
-    # Returns the connections
-    return conns
+    return get_index().find(getattr(ConnectionType, dev_type), ifname)
+
 
 def title(enum: Enum) -> str:
     """Get the name of an enum: 1st character is uppercase, rest lowercase"""
@@ -116,6 +97,35 @@ def string_or_numeric(value: any)->int | float | str:
             return value
         
 
+class PhaseTimer:
+    """
+    Time the phases of a sequence of steps (e.g. startup) and report where
+    the time went:
+
+        timer = PhaseTimer('Startup')
+        with timer.phase('start hotspot'):
+            ...
+        logger.info(timer.report())
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.phases = [] # (name, seconds)
+        self.start = time.monotonic()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.monotonic() - start))
+
+    def report(self) -> str:
+        total = time.monotonic() - self.start
+        phases = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in self.phases)
+        return f'{self.name} took {total:.2f}s: {phases}'
+
+
 def create_state_file(value: str)->bool:
     base = '/etc/wifi_state'
     files = {'hotspot':os.path.join(base,'hotspot'), 'client':os.path.join(base,'client')}
@@ -0,0 +1,6 @@
+# The modules under test live in src/ and import each other by top-level
+# name, as they do when run from there.
+
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
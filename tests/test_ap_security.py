@@ -0,0 +1,46 @@
+import pytest
+
+from sdbus_block.networkmanager.enums import (
+    AccessPointCapabilities as Cap,
+    WpaSecurityFlags as Sec,
+)
+
+from ap_security import classify
+
+CCMP = Sec.P2P_CCMP | Sec.BROADCAST_CCMP
+TKIP = Sec.P2P_TKIP | Sec.BROADCAST_TKIP
+
+# (flags, wpa_flags, rsn_flags), (security, required input)
+TABLE = {
+    'open':             ((Cap.NONE, Sec.NONE, Sec.NONE), ('NONE', 'NONE')),
+    'WEP':              ((Cap.PRIVACY, Sec.NONE, Sec.NONE), ('WEP', 'PASSWORD')),
+    'WPA1':             ((Cap.PRIVACY, TKIP | Sec.AUTH_PSK, Sec.NONE), ('WPA', 'PASSWORD')),
+    'WPA2':             ((Cap.PRIVACY, Sec.NONE, CCMP | Sec.AUTH_PSK), ('WPA2', 'PASSWORD')),
+    'WPA1/WPA2 mixed':  ((Cap.PRIVACY, TKIP | Sec.AUTH_PSK, CCMP | Sec.AUTH_PSK), ('WPA2', 'PASSWORD')),
+    'WPA3':             ((Cap.PRIVACY, Sec.NONE, CCMP | Sec.AUTH_SAE), ('WPA3', 'PASSWORD')),
+    'WPA2/WPA3 transition': ((Cap.PRIVACY, Sec.NONE, CCMP | Sec.AUTH_PSK | Sec.AUTH_SAE), ('WPA2', 'PASSWORD')),
+    'OWE':              ((Cap.PRIVACY, Sec.NONE, CCMP | Sec.AUTH_OWE), ('OWE', 'NONE')),
+    'OWE transition, open half': ((Cap.NONE, Sec.NONE, Sec.AUTH_OWE_TM), ('NONE', 'NONE')),
+    'enterprise 802.1X': ((Cap.PRIVACY, Sec.NONE, CCMP | Sec.AUTH_802_1X), ('ENTERPRISE', 'USERNAME PASSWORD')),
+    'enterprise WPA1 802.1X': ((Cap.PRIVACY, TKIP | Sec.AUTH_802_1X, Sec.NONE), ('ENTERPRISE', 'USERNAME PASSWORD')),
+    'enterprise Suite B 192': ((Cap.PRIVACY, Sec.NONE, CCMP | Sec.AUTH_EAP_SUITE_B), ('ENTERPRISE', 'USERNAME PASSWORD')),
+}
+
+
+@pytest.mark.parametrize('flags, expected', TABLE.values(), ids=TABLE.keys())
+def test_classify(flags, expected):
+    assert classify(*flags) == expected
+
+
+@pytest.mark.parametrize('flags, expected', TABLE.values(), ids=TABLE.keys())
+def test_classify_plain_ints(flags, expected):
+    # D-Bus hands us plain ints, not the enums.
+    assert classify(*(int(f) for f in flags)) == expected
+
+
+def test_classify_is_memoized():
+    classify.cache_clear()
+    flags = (int(Cap.PRIVACY), 0, int(CCMP | Sec.AUTH_PSK))
+    classify(*flags)
+    classify(*flags)
+    assert classify.cache_info().hits == 1
@@ -0,0 +1,240 @@
+# The built-in responder's DNS answers and DHCP replies, on packets built
+# here, including broken ones.
+
+import socket, struct
+
+import pytest
+
+from captive_responder import (
+    CaptiveResponder,
+    DhcpProtocol,
+    DhcpPacket,
+    LeasePool,
+    dns_response,
+    MAGIC_COOKIE,
+    DHCPDISCOVER, DHCPOFFER, DHCPREQUEST, DHCPDECLINE, DHCPACK, DHCPNAK,
+    OPT_MESSAGE_TYPE, OPT_REQUESTED_IP, OPT_SERVER_ID, OPT_END,
+)
+
+GATEWAY = '192.168.42.1'
+GATEWAY_BYTES = socket.inet_aton(GATEWAY)
+TTL = 10
+
+TYPE_A, TYPE_AAAA, TYPE_HTTPS = 1, 28, 65
+RD = 0x0100
+
+
+#------------------------------------------------------------------------------
+# DNS
+def dns_query(name=b'\x07example\x03com\x00', qtype=TYPE_A, flags=RD,
+        query_id=0x1234, qdcount=1) -> bytes:
+    return struct.pack('!HHHHHH', query_id, flags, qdcount, 0, 0, 0) \
+            + name + struct.pack('!HH', qtype, 1)
+
+
+def header(response: bytes) -> tuple:
+    # id, flags, qdcount, ancount, nscount, arcount
+    return struct.unpack('!HHHHHH', response[:12])
+
+
+def test_a_query_is_answered_with_the_gateway():
+    query = dns_query()
+    response = dns_response(query, GATEWAY_BYTES, TTL)
+    query_id, flags, qdcount, ancount, _, _ = header(response)
+    assert (query_id, qdcount, ancount) == (0x1234, 1, 1)
+    assert flags & 0x8000 and flags & RD and flags & 0xF == 0
+    assert response[12:len(query)] == query[12:] # the question, echoed
+    answer = response[len(query):]
+    assert answer[:2] == b'\xc0\x0c' # points at the question's name
+    assert struct.unpack('!HHIH', answer[2:12]) == (TYPE_A, 1, TTL, 4)
+    assert answer[12:] == GATEWAY_BYTES
+
+
+@pytest.mark.parametrize('qtype', [TYPE_AAAA, TYPE_HTTPS])
+def test_other_types_get_an_empty_noerror(qtype):
+    query = dns_query(qtype=qtype)
+    response = dns_response(query, GATEWAY_BYTES, TTL)
+    _, flags, qdcount, ancount, _, _ = header(response)
+    assert flags & 0xF == 0 # NOERROR
+    assert (qdcount, ancount) == (1, 0)
+    assert response[12:] == query[12:]
+
+
+@pytest.mark.parametrize('query', [
+    b'',
+    b'\x12\x34\x01\x00\x00\x01', # header cut short
+    dns_query()[:-2], # no class
+    dns_query()[:14], # name runs past the end
+    dns_query(name=b'\x3fexample\x00'), # label longer than the packet
+    dns_query(name=b'\xc0\x0c'), # compression pointer in the question
+    dns_query(name=b'\x07example\xc0\x0c'),
+    dns_query(qdcount=2),
+    dns_query(qdcount=0),
+    dns_query(flags=0x8000 | RD), # a response, not a query
+], ids=['empty', 'short header', 'no class', 'truncated name', 'long label',
+        'pointer', 'pointer after label', 'two questions', 'no question',
+        'response'])
+def test_malformed_queries_are_dropped(query):
+    assert dns_response(query, GATEWAY_BYTES, TTL) is None
+
+
+@pytest.mark.parametrize('opcode', [1, 2, 4, 5]) # IQUERY, STATUS, NOTIFY, UPDATE
+def test_other_opcodes_are_not_implemented(opcode):
+    response = dns_response(dns_query(flags=opcode << 11), GATEWAY_BYTES, TTL)
+    query_id, flags, qdcount, ancount, _, _ = header(response)
+    assert query_id == 0x1234 and flags & 0x8000
+    assert flags & 0xF == 4 # NOTIMP
+    assert (qdcount, ancount) == (0, 0)
+    assert len(response) == 12
+
+
+#------------------------------------------------------------------------------
+# DHCP
+def dhcp_packet(message_type, mac='02:00:00:00:00:01', options=None,
+        ciaddr='0.0.0.0') -> DhcpPacket:
+    chaddr = bytes.fromhex(mac.replace(':', '')).ljust(16, b'\0')
+    data = bytes([1, 1, 6, 0]) + b'\xde\xad\xbe\xef' + bytes(4) \
+            + socket.inet_aton(ciaddr) + bytes(12) + chaddr + bytes(192) \
+            + MAGIC_COOKIE + bytes([OPT_MESSAGE_TYPE, 1, message_type])
+    for code, value in (options or {}).items():
+        data += bytes([code, len(value)]) + value
+    return DhcpPacket(data + bytes([OPT_END]))
+
+
+def parse_reply(reply: bytes) -> tuple[int, str]:
+    packet = DhcpPacket(reply)
+    assert packet.op == 2 and packet.xid == b'\xde\xad\xbe\xef'
+    return packet.message_type, socket.inet_ntoa(reply[16:20])
+
+
+def requested(address):
+    return {OPT_REQUESTED_IP: socket.inet_aton(address)}
+
+
+@pytest.fixture
+def responder():
+    responder = CaptiveResponder(GATEWAY, '192.168.42.10,192.168.42.19',
+            lease_time='1h', max_leases=3)
+    responder.pool = LeasePool(*responder.dhcp_range, responder.lease_time,
+            responder.max_leases)
+    return responder
+
+
+def test_discover_gets_an_offer(responder):
+    reply = responder.dhcp_reply(dhcp_packet(DHCPDISCOVER))
+    assert parse_reply(reply) == (DHCPOFFER, '192.168.42.10')
+    options = DhcpPacket(reply).options
+    assert options[OPT_SERVER_ID] == GATEWAY_BYTES
+    assert options[3] == GATEWAY_BYTES and options[6] == GATEWAY_BYTES
+    assert options[51] == struct.pack('!I', 3600)
+    assert options[114] == b'http://192.168.42.1/'
+
+
+def test_discover_gets_the_address_it_asks_for(responder):
+    reply = responder.dhcp_reply(dhcp_packet(DHCPDISCOVER,
+            options=requested('192.168.42.15')))
+    assert parse_reply(reply) == (DHCPOFFER, '192.168.42.15')
+
+
+def test_request_gets_an_ack(responder):
+    options = {**requested('192.168.42.10'), OPT_SERVER_ID: GATEWAY_BYTES}
+    reply = responder.dhcp_reply(dhcp_packet(DHCPREQUEST, options=options))
+    assert parse_reply(reply) == (DHCPACK, '192.168.42.10')
+    assert responder.pool.leases['02:00:00:00:00:01'][0] == '192.168.42.10'
+    # Renewing (ciaddr, no requested IP option) keeps it.
+    reply = responder.dhcp_reply(dhcp_packet(DHCPREQUEST, ciaddr='192.168.42.10'))
+    assert parse_reply(reply) == (DHCPACK, '192.168.42.10')
+
+
+@pytest.mark.parametrize('address', ['10.0.0.5', '192.168.42.1', '192.168.42.20'])
+def test_request_for_a_foreign_address_gets_a_nak(responder, address):
+    reply = responder.dhcp_reply(dhcp_packet(DHCPREQUEST, options=requested(address)))
+    assert parse_reply(reply) == (DHCPNAK, '0.0.0.0')
+    assert 51 not in DhcpPacket(reply).options # no lease time on a NAK
+    assert responder.pool.leases == {}
+
+
+def test_request_for_an_address_leased_to_another_gets_a_nak(responder):
+    responder.dhcp_reply(dhcp_packet(DHCPREQUEST, options=requested('192.168.42.10')))
+    reply = responder.dhcp_reply(dhcp_packet(DHCPREQUEST, mac='02:00:00:00:00:02',
+            options=requested('192.168.42.10')))
+    assert parse_reply(reply)[0] == DHCPNAK
+
+
+def test_request_to_another_server_is_ignored(responder):
+    options = {**requested('192.168.42.10'),
+            OPT_SERVER_ID: socket.inet_aton('192.168.42.2')}
+    assert responder.dhcp_reply(dhcp_packet(DHCPREQUEST, options=options)) is None
+
+
+def test_declined_address_is_not_offered_again(responder):
+    responder.dhcp_reply(dhcp_packet(DHCPREQUEST, options=requested('192.168.42.10')))
+    assert responder.dhcp_reply(dhcp_packet(DHCPDECLINE,
+            options=requested('192.168.42.10'))) is None
+    assert responder.pool.leases == {}
+    for mac in ('02:00:00:00:00:01', '02:00:00:00:00:02'):
+        reply = responder.dhcp_reply(dhcp_packet(DHCPDISCOVER, mac=mac,
+                options=requested('192.168.42.10')))
+        assert parse_reply(reply) == (DHCPOFFER, '192.168.42.11')
+
+
+def test_pool_is_exhausted_at_max_leases(responder):
+    for n in range(3):
+        mac = f'02:00:00:00:00:0{n}'
+        offer = parse_reply(responder.dhcp_reply(dhcp_packet(DHCPDISCOVER, mac=mac)))[1]
+        reply = responder.dhcp_reply(dhcp_packet(DHCPREQUEST, mac=mac,
+                options=requested(offer)))
+        assert parse_reply(reply)[0] == DHCPACK
+    assert responder.dhcp_reply(dhcp_packet(DHCPDISCOVER, mac='02:00:00:00:00:09')) is None
+    reply = responder.dhcp_reply(dhcp_packet(DHCPREQUEST, mac='02:00:00:00:00:09',
+            options=requested('192.168.42.18')))
+    assert parse_reply(reply)[0] == DHCPNAK
+    # A client that has a lease still gets it.
+    reply = responder.dhcp_reply(dhcp_packet(DHCPDISCOVER, mac='02:00:00:00:00:00'))
+    assert parse_reply(reply) == (DHCPOFFER, '192.168.42.10')
+
+
+def test_pool_is_exhausted_at_the_end_of_the_range():
+    pool = LeasePool('192.168.42.10', '192.168.42.11', 3600, 253)
+    assert pool.lease('a', pool.offer('a', None))
+    assert pool.lease('b', pool.offer('b', None))
+    assert pool.offer('c', None) is None
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    bytes(239),
+    bytes(236) + b'\0\0\0\0', # no magic cookie
+], ids=['empty', 'short', 'no cookie'])
+def test_not_a_dhcp_packet(data):
+    with pytest.raises(ValueError):
+        DhcpPacket(data)
+
+
+def test_truncated_option_is_cut_short():
+    data = bytes(236) + MAGIC_COOKIE + bytes([OPT_MESSAGE_TYPE, 1, DHCPDISCOVER,
+            OPT_REQUESTED_IP, 4, 192, 168])
+    packet = DhcpPacket(data)
+    assert packet.message_type == DHCPDISCOVER
+    assert packet.requested_ip is None # 2 of its 4 bytes
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    bytes(236) + MAGIC_COOKIE + bytes([OPT_MESSAGE_TYPE]), # no option length
+    bytes([2]) + bytes(235) + MAGIC_COOKIE + bytes([OPT_MESSAGE_TYPE, 1,
+            DHCPDISCOVER, OPT_END]), # a reply, not a request
+], ids=['empty', 'no option length', 'bootreply'])
+def test_dhcp_garbage_is_dropped(responder, data):
+    protocol = DhcpProtocol(responder)
+    protocol.connection_made(FakeTransport())
+    protocol.datagram_received(data, ('0.0.0.0', 68))
+    assert protocol.transport.sent == []
@@ -0,0 +1,98 @@
+# The connection index's lookups and its handling of signals, fed records
+# directly instead of from NetworkManager.
+
+import asyncio
+
+import connection_index
+from connection_index import ConnectionIndex, ConnectionRecord
+
+WIFI = '802-11-wireless'
+ETHERNET = '802-3-ethernet'
+
+
+def record(n, connection_id, connection_type=WIFI, interface='', timestamp=0):
+    return ConnectionRecord(f'/Settings/{n}', f'uuid-{n}', connection_id,
+            connection_type, interface, timestamp)
+
+
+def fake_fetch(records, gate=None):
+    async def fetch_records(paths, bus):
+        if gate is not None:
+            await gate.wait()
+        return [records[path] for path in paths if path in records]
+    return fetch_records
+
+
+def load(monkeypatch, *records):
+    index = ConnectionIndex()
+    by_path = {r.path: r for r in records}
+    monkeypatch.setattr(connection_index, 'fetch_records', fake_fetch(by_path))
+    asyncio.run(index._fetch(list(by_path), 'load'))
+    return index
+
+
+def test_lookups(monkeypatch):
+    index = load(monkeypatch,
+            record(1, 'home', interface='wlan0', timestamp=5),
+            record(2, 'home', timestamp=9),
+            record(3, 'cafe', interface='wlan1'),
+            record(4, 'wired', ETHERNET))
+
+    assert index.get_by_uuid('uuid-3').id == 'cafe'
+    assert index.get_by_uuid('uuid-9') is None
+    assert index.get_by_id('home').uuids() == ['uuid-2', 'uuid-1'] # newest first
+    assert index.find(WIFI).uuids() == ['uuid-2', 'uuid-1', 'uuid-3']
+    assert index.find(WIFI, 'wlan1').uuids() == ['uuid-2', 'uuid-3']
+    assert sorted(index.find(interface='wlan0').uuids()) == ['uuid-1', 'uuid-2', 'uuid-4']
+    assert index.find(ETHERNET, connection_id='home').uuids() == []
+
+
+def test_update_moves_the_record(monkeypatch):
+    index = load(monkeypatch, record(1, 'home', interface='wlan0'))
+    renamed = record(1, 'office', interface='wlan1')
+    monkeypatch.setattr(connection_index, 'fetch_records',
+            fake_fetch({renamed.path: renamed}))
+    asyncio.run(index._fetch([renamed.path], 'updated'))
+
+    assert index.get_by_id('home').uuids() == []
+    assert index.get_by_id('office').uuids() == ['uuid-1']
+    assert index.find(interface='wlan0').uuids() == []
+    assert 'home' not in index._by_id and 'wlan0' not in index._by_interface
+
+
+def test_update_of_unknown_profile_is_ignored(monkeypatch):
+    index = load(monkeypatch)
+    new = record(1, 'home')
+    monkeypatch.setattr(connection_index, 'fetch_records',
+            fake_fetch({new.path: new}))
+    asyncio.run(index._fetch([new.path], 'updated'))
+    assert index.get_by_uuid('uuid-1') is None
+
+
+def test_remove(monkeypatch):
+    index = load(monkeypatch, record(1, 'home'), record(2, 'home'))
+    index._remove('/Settings/1')
+
+    assert index.get_by_uuid('uuid-1') is None
+    assert index.get_by_id('home').uuids() == ['uuid-2']
+    assert index._removed == set() # no fetch in flight to guard against
+
+
+def test_removed_during_fetch_stays_removed(monkeypatch):
+    index = ConnectionIndex()
+    new = record(1, 'home')
+
+    async def run():
+        gate = asyncio.Event()
+        monkeypatch.setattr(connection_index, 'fetch_records',
+                fake_fetch({new.path: new}, gate))
+        fetch = asyncio.create_task(index._fetch([new.path]))
+        await asyncio.sleep(0)
+        index._remove(new.path) # the signal overtakes the fetch
+        assert index._removed == {new.path}
+        gate.set()
+        return await fetch
+
+    assert asyncio.run(run()) == []
+    assert index.get_by_uuid('uuid-1') is None
+    assert index._removed == set() and not index._fetching
@@ -0,0 +1,49 @@
+# The connection profiles the portal form turns into, for WEP networks and
+# hidden networks whose security we have to guess from the password.
+
+import pytest
+
+from ap_security import SECURITY_WEP, SECURITY_WPA2
+from connection_profiles import (
+    CONN_TYPE_SEC_PASSWORD,
+    CONN_TYPE_SEC_WEP,
+    build_connection_dict,
+)
+from credentials import check_credentials, hidden_security
+
+
+@pytest.mark.parametrize('key', ['abcde', 'abcdefghijklm', '0123456789',
+        '0123456789abcdef0123456789'])
+def test_wep_profile(key):
+    settings, display = build_connection_dict(CONN_TYPE_SEC_WEP, 'conn', 'ssid',
+            password=key)
+    security = settings['802-11-wireless-security']
+    assert display == 'WEP'
+    assert security['key-mgmt'] == ('s', 'none')
+    assert security['wep-key0'] == ('s', key)
+    assert security['wep-key-type'] == ('u', 1)
+    assert 'psk' not in security
+
+
+def test_password_profile_is_wpa_psk():
+    settings, _ = build_connection_dict(CONN_TYPE_SEC_PASSWORD, 'conn', 'ssid',
+            password='password123')
+    assert settings['802-11-wireless-security']['key-mgmt'] == ('s', 'wpa-psk')
+
+
+def test_wep_key_is_checked_as_wep():
+    ssids = [{'ssid': 'old', 'security': SECURITY_WEP}]
+    assert check_credentials(ssids, 'old', None, 'abcde') is None
+    assert check_credentials(ssids, 'old', None, 'password123') is not None
+
+
+@pytest.mark.parametrize('password, security', [
+    ('abcde', SECURITY_WEP),                      # too short for WPA
+    ('abcdefghijklm', SECURITY_WPA2),             # may be either, WPA is likelier
+    ('0123456789', SECURITY_WPA2),
+    ('0123456789abcdef0123456789', SECURITY_WPA2),
+    ('password123', SECURITY_WPA2),
+])
+def test_hidden_security(password, security):
+    assert check_credentials([], 'hidden', None, password, hidden=True) is None
+    assert hidden_security(password) == security
@@ -0,0 +1,144 @@
+# The connectivity checker against local listeners: one that answers HTTP 204
+# like the generate_204 URL, one that redirects like a captive portal, one
+# that accepts but never answers, and a port nothing listens on.
+
+import socket, threading, time
+
+import pytest
+
+from connectivity import ConnectivityChecker
+
+
+def listener():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+    return server
+
+
+# Stop listening, also waking a thread blocked in accept().
+def stop(server):
+    try:
+        server.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    server.close()
+
+
+def target(server) -> str:
+    return f'127.0.0.1:{server.getsockname()[1]}'
+
+
+def url(server, path='/generate_204') -> str:
+    return f'http://{target(server)}{path}'
+
+
+# Answer every request with status, until the listener is closed.
+def serve(server, status: bytes):
+    def run():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn:
+                conn.recv(4096)
+                conn.sendall(b'HTTP/1.1 ' + status + b'\r\nContent-Length: 0\r\n\r\n')
+    threading.Thread(target=run, daemon=True).start()
+
+
+@pytest.fixture
+def silent():
+    server = listener() # the kernel accepts, nobody ever answers
+    yield server
+    stop(server)
+
+
+@pytest.fixture
+def no_content():
+    server = listener()
+    serve(server, b'204 No Content')
+    yield server
+    stop(server)
+
+
+@pytest.fixture
+def captive():
+    server = listener()
+    serve(server, b'302 Found')
+    yield server
+    stop(server)
+
+
+@pytest.fixture
+def closed_port():
+    server = listener()
+    address = target(server)
+    server.close()
+    return address
+
+
+def checker(tcp=(), http=(), timeout=0.5, ttl=5):
+    return ConnectivityChecker(list(tcp), list(http), use_nm=False,
+            timeout=timeout, ttl=ttl)
+
+
+def timed_check(checker):
+    start = time.monotonic()
+    result = checker.check()
+    return result, time.monotonic() - start
+
+
+def test_first_success_wins(no_content, silent):
+    result, elapsed = timed_check(checker(http=[url(silent), url(no_content)],
+            timeout=5))
+    assert result
+    assert elapsed < 1 # did not wait for the silent one
+
+
+def test_tcp_connect_is_enough(silent):
+    assert checker(tcp=[target(silent)]).check()
+
+
+def test_probe_that_never_answers_times_out(silent):
+    result, elapsed = timed_check(checker(http=[url(silent)], timeout=0.3))
+    assert not result
+    assert 0.3 <= elapsed < 2
+
+
+def test_all_probes_failing_is_offline(captive, silent, closed_port):
+    result, elapsed = timed_check(checker(tcp=[closed_port],
+            http=[url(captive), url(silent), f'http://{closed_port}/'],
+            timeout=0.3))
+    assert not result
+    assert elapsed < 2
+
+
+def test_result_is_cached_within_ttl(no_content):
+    online = checker(http=[url(no_content)], timeout=0.3)
+    assert online.check()
+    stop(no_content)
+    assert online.cached() is True
+    assert online.check() # still within the TTL
+    online.invalidate()
+    assert not online.check()
+
+
+def test_result_expires_after_ttl(no_content):
+    online = checker(http=[url(no_content)], timeout=0.3, ttl=0.2)
+    assert online.check()
+    stop(no_content)
+    time.sleep(0.3)
+    assert online.cached() is None
+    assert not online.check()
+
+
+@pytest.mark.parametrize('default_timeout', [None, 7.0])
+def test_default_socket_timeout_is_left_alone(silent, closed_port, default_timeout):
+    previous = socket.getdefaulttimeout()
+    socket.setdefaulttimeout(default_timeout)
+    try:
+        checker(tcp=[closed_port], http=[url(silent)], timeout=0.2).check()
+        assert socket.getdefaulttimeout() == default_timeout
+    finally:
+        socket.setdefaulttimeout(previous)
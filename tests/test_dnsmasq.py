@@ -0,0 +1,84 @@
+# The supervisor's readiness check: only the sockets of its own child count,
+# not those of another process (the system's dnsmasq) on the same ports.
+
+import socket, subprocess, sys
+
+import pytest
+
+import dnsmasq
+
+# Binds udp and tcp on DNS_PORT and udp on DHCP_PORT, if told to, and waits.
+CHILD = '''
+import socket, sys, time
+dns_port, dhcp_port, bind = int(sys.argv[1]), int(sys.argv[2]), sys.argv[3] == '1'
+held = []
+if bind:
+    for kind, port in ((socket.SOCK_DGRAM, dns_port), (socket.SOCK_STREAM, dns_port),
+            (socket.SOCK_DGRAM, dhcp_port)):
+        s = socket.socket(socket.AF_INET, kind)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('127.0.0.1', port))
+        if kind == socket.SOCK_STREAM:
+            s.listen()
+        held.append(s)
+print('ready', flush=True)
+time.sleep(30)
+'''
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    dns_port, dhcp_port = free_port(), free_port()
+    monkeypatch.setattr(dnsmasq, 'DEFAULT_GATEWAY', '127.0.0.1')
+    monkeypatch.setattr(dnsmasq, 'DNS_PORT', dns_port)
+    monkeypatch.setattr(dnsmasq, 'DHCP_PORT', dhcp_port)
+    return dns_port, dhcp_port
+
+
+def spawn(dns_port, dhcp_port, bind):
+    ps = subprocess.Popen([sys.executable, '-c', CHILD, str(dns_port),
+            str(dhcp_port), '1' if bind else '0'], stdout=subprocess.PIPE)
+    assert ps.stdout.readline() == b'ready\n'
+    return ps
+
+
+@pytest.fixture
+def children():
+    started = []
+    yield started
+    for ps in started:
+        ps.kill()
+        ps.wait()
+
+
+def test_child_sockets_count(ports, children):
+    children.append(spawn(*ports, bind=True))
+    assert dnsmasq.wait_until_listening(children[-1], timeout=2)
+
+
+def test_sockets_of_another_process_do_not_count(ports, children):
+    children.append(spawn(*ports, bind=True)) # the system's dnsmasq
+    children.append(spawn(*ports, bind=False)) # ours, still starting
+    assert not dnsmasq.wait_until_listening(children[-1], timeout=0.5)
+
+
+def test_bound_sockets_only_of_the_given_inodes(ports, children):
+    dns_port, dhcp_port = ports
+    children.append(spawn(*ports, bind=True))
+    inodes = dnsmasq.socket_inodes(children[-1].pid)
+    assert dnsmasq.bound_sockets('udp', inodes) >= \
+            {('127.0.0.1', dns_port), ('127.0.0.1', dhcp_port)}
+    assert ('127.0.0.1', dns_port) in dnsmasq.bound_sockets('tcp', inodes)
+    assert dnsmasq.bound_sockets('udp', dnsmasq.socket_inodes(0)) == set()
+
+
+def test_exited_process_is_not_ready(ports):
+    ps = subprocess.Popen([sys.executable, '-c', 'pass'])
+    ps.wait()
+    assert not dnsmasq.wait_until_listening(ps, timeout=2)
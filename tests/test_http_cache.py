@@ -0,0 +1,24 @@
+# Accept-Encoding negotiation: a coding's own q-value wins over '*'.
+
+import pytest
+
+from http_cache import accepts_encoding
+
+
+@pytest.mark.parametrize('header, encoding, accepted', [
+    ('gzip', 'gzip', True),
+    ('gzip, deflate, br', 'br', True),
+    ('deflate', 'gzip', False),
+    ('GZIP; Q=0.5', 'gzip', True),
+    ('gzip;q=0', 'gzip', False),
+    ('gzip;q=0, *', 'gzip', False),
+    ('*, gzip;q=0', 'gzip', False),
+    ('gzip;q=0, *', 'br', True),
+    ('*;q=0', 'gzip', False),
+    ('identity, *;q=0.1', 'br', True),
+    ('gzip;q=nope', 'gzip', False),
+    ('', 'gzip', False),
+    (None, 'gzip', False),
+])
+def test_accepts_encoding(header, encoding, accepted):
+    assert accepts_encoding(header, encoding) is accepted
@@ -0,0 +1,150 @@
+# The signal-driven waits of nm_events, against a fake NetworkManager device
+# exported on a private dbus-daemon.
+
+import nm_async # first, see nm_async.py
+
+import asyncio
+from unittest import main
+
+from sdbus import dbus_property_async_override, sd_bus_open_user
+from sdbus.unittest import IsolatedDbusTestCase
+from sdbus_async.networkmanager.enums import DeviceState, DeviceStateReason
+from sdbus_async.networkmanager.interfaces_devices import (
+    NetworkManagerDeviceInterfaceAsync,
+)
+
+from nm_events import wait_for_activation, wait_for_deactivation
+
+SERVICE = 'org.freedesktop.NetworkManager'
+DEVICE_PATH = '/org/freedesktop/NetworkManager/Devices/1'
+OLD_CONNECTION = '/org/freedesktop/NetworkManager/ActiveConnection/1'
+NEW_CONNECTION = '/org/freedesktop/NetworkManager/ActiveConnection/2'
+NO_REASON = 0 # NM_DEVICE_STATE_REASON_NONE, not in the enum
+
+
+class FakeDevice(NetworkManagerDeviceInterfaceAsync):
+
+    def __init__(self, state=DeviceState.DISCONNECTED, active_connection='/'):
+        super().__init__()
+        self._state = state
+        self._reason = NO_REASON
+        self._active_connection = active_connection
+
+    @dbus_property_async_override()
+    def state(self) -> int:
+        return self._state
+
+    @dbus_property_async_override()
+    def state_reason(self) -> tuple[int, int]:
+        return (self._state, self._reason)
+
+    @dbus_property_async_override()
+    def active_connection(self) -> str:
+        return self._active_connection
+
+    def set_state(self, state, reason=NO_REASON, active_connection=None):
+        old, self._state, self._reason = self._state, state, reason
+        if active_connection is not None:
+            self._active_connection = active_connection
+        self.state_changed.emit((state, old, reason))
+
+
+class TestNmEvents(IsolatedDbusTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        await self.bus.request_name_async(SERVICE, 0)
+        self.client_bus = sd_bus_open_user() # like run_on_private_bus()
+
+    # Exported objects are only held weakly, keep the device alive.
+    def export(self, device: FakeDevice) -> FakeDevice:
+        device.export_to_dbus(DEVICE_PATH, self.bus)
+        self.device = device
+        return device
+
+    # Run the states one after the other, delay seconds apart, while the
+    # wait is running.
+    def later(self, *steps, delay=0.05):
+        loop = asyncio.get_running_loop()
+        for n, step in enumerate(steps, 1):
+            loop.call_later(delay * n, step)
+
+    #--------------------------------------------------------------------------
+    async def test_activated(self):
+        device = self.export(FakeDevice())
+        states = []
+        self.later(lambda: device.set_state(DeviceState.PREPARE),
+                lambda: device.set_state(DeviceState.IP_CONFIG),
+                lambda: device.set_state(DeviceState.ACTIVATED))
+        result = await wait_for_activation(DEVICE_PATH, timeout=5,
+                on_state=lambda state, reason: states.append(state),
+                bus=self.client_bus)
+        self.assertTrue(result.activated)
+        self.assertEqual(result.state, DeviceState.ACTIVATED)
+        self.assertEqual(states, [DeviceState.DISCONNECTED, DeviceState.PREPARE,
+                DeviceState.IP_CONFIG, DeviceState.ACTIVATED])
+        self.assertLess(result.elapsed, 1)
+
+    async def test_failed_with_reason(self):
+        device = self.export(FakeDevice())
+        self.later(lambda: device.set_state(DeviceState.NEED_AUTH),
+                lambda: device.set_state(DeviceState.FAILED,
+                    DeviceStateReason.NO_SECRETS))
+        result = await wait_for_activation(DEVICE_PATH, timeout=5,
+                bus=self.client_bus)
+        self.assertFalse(result.activated)
+        self.assertEqual(result.state, DeviceState.FAILED)
+        self.assertEqual(result.reason, DeviceStateReason.NO_SECRETS)
+        self.assertIn('NO_SECRETS', result.describe())
+
+    async def test_timeout(self):
+        device = self.export(FakeDevice())
+        self.later(lambda: device.set_state(DeviceState.CONFIG))
+        result = await wait_for_activation(DEVICE_PATH, timeout=0.3,
+                bus=self.client_bus)
+        self.assertFalse(result.activated)
+        self.assertEqual(result.state, DeviceState.CONFIG)
+        self.assertGreaterEqual(result.elapsed, 0.3)
+        self.assertLess(result.elapsed, 1)
+
+    async def test_stale_activated_is_not_trusted(self):
+        # Still ACTIVATED on the connection we replaced.
+        device = self.export(FakeDevice(DeviceState.ACTIVATED, OLD_CONNECTION))
+        self.later(lambda: device.set_state(DeviceState.DEACTIVATING),
+                lambda: device.set_state(DeviceState.PREPARE,
+                    active_connection=NEW_CONNECTION),
+                lambda: device.set_state(DeviceState.ACTIVATED), delay=0.1)
+        result = await wait_for_activation(DEVICE_PATH, NEW_CONNECTION,
+                timeout=5, bus=self.client_bus)
+        self.assertTrue(result.activated)
+        self.assertGreaterEqual(result.elapsed, 0.25) # not the stale state
+
+    async def test_stale_activated_times_out(self):
+        self.export(FakeDevice(DeviceState.ACTIVATED, OLD_CONNECTION))
+        result = await wait_for_activation(DEVICE_PATH, NEW_CONNECTION,
+                timeout=0.3, bus=self.client_bus)
+        self.assertFalse(result.activated)
+
+    #--------------------------------------------------------------------------
+    async def test_deactivation(self):
+        device = self.export(FakeDevice(DeviceState.ACTIVATED, OLD_CONNECTION))
+        self.later(lambda: device.set_state(DeviceState.DEACTIVATING),
+                lambda: device.set_state(DeviceState.DISCONNECTED,
+                    active_connection='/'))
+        self.assertTrue(await wait_for_deactivation([DEVICE_PATH], timeout=5,
+                bus=self.client_bus))
+
+    async def test_deactivation_of_an_idle_device(self):
+        self.export(FakeDevice(DeviceState.DISCONNECTED))
+        self.assertTrue(await wait_for_deactivation([DEVICE_PATH], timeout=1,
+                bus=self.client_bus))
+
+    async def test_deactivation_timeout(self):
+        device = self.export(FakeDevice(DeviceState.ACTIVATED, OLD_CONNECTION))
+        self.later(lambda: device.set_state(DeviceState.DEACTIVATING))
+        self.assertFalse(await wait_for_deactivation([DEVICE_PATH], timeout=0.3,
+                bus=self.client_bus))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ $(function(){
         $('#identity-group').addClass('hidden');
         $('#passphrase-group').addClass('hidden');
         $('#hidden-ssid-group').addClass('hidden');
-        if(security === 'NONE') {
+        if(security === 'NONE' || security === 'OWE') {
             return; // nothing to do
         }
         if(security === 'ENTERPRISE') {
@@ -19,7 +19,7 @@ $(function(){
             $('#hidden-ssid-group').removeClass('hidden');
             // fall through
         } 
-        // otherwise security is HIDDEN, WEP, WPA, or WPA2 which need password
+        // otherwise security is HIDDEN, WEP, WPA, WPA2 or WPA3 which need password
         $('#passphrase-group').removeClass('hidden');
     }
 
@@ -38,7 +38,8 @@ $(function(){
             $('.before-submit').hide();
             $('#no-networks-message').removeClass('hidden');
         } else {
-            networks = JSON.parse(data);
+            // served as application/json, so jQuery has already parsed it
+            networks = (typeof data === 'string') ? JSON.parse(data) : data;
             $.each(networks, function(i, val){
                 $('#ssid-select').append(
                     $('<option>')
@@ -52,10 +53,59 @@ $(function(){
         }
     });
 
+    var stepText = {
+        'queued': 'Waiting to connect...',
+        'stopping-hotspot': 'Stopping the access point...',
+        'connecting': 'Connecting...',
+        'restarting-hotspot': 'Could not connect, restarting the access point...',
+        'connected': 'Connected!',
+        'failed': 'Could not connect, please check the password and try again.'
+    };
+
+    // Poll the connection job until it is done.  Requests fail while the
+    // access point is down, so just keep trying.
+    function pollStatus(statusUrl) {
+        $.getJSON(statusUrl, function(job){
+            var text = stepText[job.step] || job.step;
+            if(job.step === 'connecting' && job.device_state) {
+                text += ' (' + job.device_state.toLowerCase().replace(/_/g, ' ') + ')';
+            }
+            if(job.step === 'failed' && job.reason) {
+                text += ' (' + job.reason.toLowerCase().replace(/_/g, ' ') + ')';
+            }
+            $('#connect-status').text(text);
+            if(job.done) {
+                if(job.step === 'failed') {
+                    // Back to the form, with the reason next to it.
+                    $('#submit-message').addClass('hidden');
+                    $('#form-error').text(text);
+                    $('.before-submit').show();
+                }
+                return;
+            }
+            setTimeout(function(){ pollStatus(statusUrl); }, 1000);
+        }).fail(function(){
+            setTimeout(function(){ pollStatus(statusUrl); }, 2000);
+        });
+    }
+
     $('#connect-form').submit(function(ev){
-        $.post('/connect', $('#connect-form').serialize(), function(data){
+        $('#form-error').text('');
+        $.post('/connect', $('#connect-form').serialize(), function(job){
             $('.before-submit').hide();
             $('#submit-message').removeClass('hidden');
+            $('#connect-status').text(stepText[job.step] || '');
+            pollStatus('/connect/status/' + job.id);
+        }).fail(function(xhr){
+            // 400: the server rejected the input without trying it
+            // 409: another connection attempt is still running
+            var error = xhr.responseJSON && xhr.responseJSON.error;
+            if(xhr.status === 409) {
+                var ssid = xhr.responseJSON && xhr.responseJSON.ssid;
+                error = 'Already connecting' + (ssid ? ' to ' + ssid : '') +
+                        ', please wait for it to finish.';
+            }
+            $('#form-error').text(error || 'Could not connect, please try again.');
         });
         ev.preventDefault();
     });